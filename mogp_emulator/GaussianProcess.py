@@ -4,7 +4,7 @@ from mogp_emulator.Priors import GPPriors
 from mogp_emulator.GPParams import GPParams, _process_nugget
 from scipy import linalg
 from scipy.optimize import OptimizeResult
-from mogp_emulator.linalg import cholesky_factor, calc_Ainv, calc_mean_params, calc_R
+from mogp_emulator.linalg import cholesky_factor, calc_Ainv, calc_mean_params
 from mogp_emulator.linalg import logdet_deriv, calc_A_deriv
 
 try:
@@ -13,6 +13,12 @@ except ImportError:
     raise ImportError("patsy is now a required dependency of mogp-emulator")
 import warnings
 
+# number of recent predictions held by each emulator when predictions are
+# cached, so that repeated calls to predict with the same points do not redo
+# the computation
+
+_PREDICT_CACHE_SIZE = 2
+
 class GaussianProcessBase(object):
     pass
 
@@ -189,9 +195,12 @@ class GaussianProcess(GaussianProcessBase):
         :rtype: GaussianProcess
 
         """
-        inputs = self._process_inputs(inputs)
+        # the emulator holds its own copy of the training data, as the
+        # design matrix and cached differences are computed from it
+
+        inputs = self._process_inputs(np.array(inputs, dtype=np.float64))
 
-        targets = np.array(targets)
+        targets = np.array(targets, dtype=np.float64)
         assert targets.ndim == 1
         assert targets.shape[0] == inputs.shape[0]
 
@@ -235,6 +244,25 @@ class GaussianProcess(GaussianProcessBase):
         self.Kinvt = None
         self.current_logpost = None
 
+        self._sqdiff_cache = {}
+        self._chol_buffer = None
+        self._cache_predictions = False
+        self._predict_cache = []
+        self._predict_dtype = np.dtype(np.float64)
+        self._predict_factors = None
+        self._deriv_cache = {}
+
+    def __getstate__(self):
+        "Drop cached arrays when pickling, as they are cheap to recompute"
+
+        state = self.__dict__.copy()
+        state["_sqdiff_cache"] = {}
+        state["_chol_buffer"] = None
+        state["_predict_cache"] = []
+        state["_predict_factors"] = None
+        state["_deriv_cache"] = {}
+        return state
+
     @property
     def inputs(self):
         """
@@ -426,9 +454,35 @@ class GaussianProcess(GaussianProcessBase):
             self.Kinv = None
             self.Kinv_t = None
             self.Ainv = None
+            self._predict_cache = []
+            self._predict_factors = None
+            self._deriv_cache = {}
         else:
             self.fit(theta)
 
+    @property
+    def cache_predictions(self):
+        """
+        Flag indicating if the emulator caches its predictions. If ``True``,
+        the emulator holds on to its last few predictions (up to
+        ``_PREDICT_CACHE_SIZE``) along with a copy of the prediction points, so
+        that repeating a prediction for the same points and options returns the
+        stored values rather than recomputing them. Predictions of the full
+        covariance are never cached due to their size. As this costs memory for
+        each cached prediction, it is ``False`` by default. The cache is cleared
+        whenever the emulator is fit, or when caching is turned off.
+
+        :returns: Flag indicating if predictions are cached
+        :rtype: bool
+        """
+        return self._cache_predictions
+
+    @cache_predictions.setter
+    def cache_predictions(self, cache_predictions):
+        self._cache_predictions = bool(cache_predictions)
+        if not self._cache_predictions:
+            self._predict_cache = []
+
     @property
     def priors(self):
         """
@@ -514,7 +568,7 @@ class GaussianProcess(GaussianProcessBase):
 
         return dm
 
-    def get_cov_matrix(self, other_inputs):
+    def get_cov_matrix(self, other_inputs, sqdiff=None):
         """Computes the covariance matrix for a set of inputs
         
         Compute the covariance matrix for the emulator. Assumes
@@ -530,6 +584,12 @@ class GaussianProcess(GaussianProcessBase):
                        with the second dimension matching ``D``
                        for this emulator.
         :type otherinputs: ndarray
+        :param sqdiff: (optional) Precomputed squared differences
+                       between the emulator inputs and ``other_inputs``
+                       as returned by ``kernel.calc_sqdiff``, with
+                       shape ``(D, n, M)``. Default is ``None``, in
+                       which case they are computed by the kernel.
+        :type sqdiff: ndarray or None
         :returns: Covariance matrix for the provided inputs
                   relative to the emulator inputs. If the
                   ``other_inputs`` array has first dimension
@@ -540,7 +600,68 @@ class GaussianProcess(GaussianProcessBase):
         other_inputs = self._process_inputs(other_inputs)
         
         return self.theta.cov*self.kernel.kernel_f(self.inputs, other_inputs,
-                                                   self.theta.corr_raw)
+                                                   self.theta.corr_raw, sqdiff=sqdiff)
+
+    def _get_chol_buffer(self):
+        """Returns the work array used to factorize the covariance matrix
+
+        The covariance matrix is factorized in place in a Fortran-ordered
+        array of shape ``(n, n)`` that is allocated the first time it
+        is needed and reused on every subsequent fit, avoiding a new
+        allocation each time the hyperparameters change when fitting.
+        Note that this means the factor held by ``Kinv`` is overwritten
+        whenever the emulator is refit.
+
+        :returns: Work array for the Cholesky factorization
+        :rtype: ndarray
+        """
+
+        if self._chol_buffer is None:
+            self._chol_buffer = np.empty((self.n, self.n), order="F")
+
+        return self._chol_buffer
+
+    def _get_sqdiff(self):
+        """Returns the squared differences between all pairs of inputs
+
+        Returns the squared differences between all pairs of training
+        inputs along each input dimension. These do not depend on the
+        hyperparameters, so while fitting they are held in a cache (see
+        ``_cache_sqdiff``) for subsequent evaluations of the covariance
+        matrix and its derivatives. Otherwise they are computed each time,
+        so that a fit emulator does not hold on to an array that is much
+        larger than the covariance matrix. The cache may be shared between
+        emulators with the same inputs (i.e. in a ``MultiOutputGP``).
+
+        :returns: Squared differences between all pairs of inputs as
+                  an array with shape ``(D, n, n)``
+        :rtype: ndarray
+        """
+
+        if "inputs" in self._sqdiff_cache:
+            return self._sqdiff_cache["inputs"]
+
+        return self.kernel.calc_sqdiff(self.inputs, self.inputs)
+
+    def _cache_sqdiff(self):
+        """Holds the squared differences between all pairs of inputs in the cache
+
+        Called before fitting, which evaluates the covariance matrix many
+        times. Returns a boolean indicating if the squared differences were
+        added to the cache (rather than already being held there), in which
+        case the caller should remove them once fitting is done.
+
+        :returns: Boolean indicating if the squared differences were added
+                  to the cache
+        :rtype: bool
+        """
+
+        if "inputs" in self._sqdiff_cache:
+            return False
+
+        self._sqdiff_cache["inputs"] = self.kernel.calc_sqdiff(self.inputs, self.inputs)
+
+        return True
 
     def get_K_matrix(self):
         """Returns current value of the covariance matrix
@@ -555,12 +676,14 @@ class GaussianProcess(GaussianProcessBase):
                   ``(n,n)``.
         :rtype: ndarray
         """
-        return self.get_cov_matrix(self.inputs)
+        return self.theta.cov*self.kernel.kernel_f(self.inputs, self.inputs,
+                                                   self.theta.corr_raw,
+                                                   sqdiff=self._get_sqdiff())
 
     def _process_inputs(self, inputs):
-        "Change inputs into an array and reshape if required"
+        "Change inputs into an array and reshape if required, without copying conforming arrays"
 
-        inputs = np.array(inputs)
+        inputs = np.ascontiguousarray(inputs, dtype=np.float64)
         if inputs.ndim == 1:
             if (not hasattr(self, "_inputs") or self.D == 1):
                 inputs = np.reshape(inputs, (-1, 1))
@@ -652,17 +775,82 @@ class GaussianProcess(GaussianProcessBase):
         :returns: None
         """
 
+        self._fit_covariance(theta)
+        self._fit_targets()
+
+    def _fit_covariance(self, theta):
+        """Sets the parameters and factorizes the covariance matrix
+
+        First step of ``fit``, which only depends on the inputs and
+        the hyperparameters, and not on the targets or mean function.
+        Clears any cached values that depend on the previous fit.
+
+        :param theta: Values of the hyperparameters to use in
+                      fitting. Must be a numpy array with length
+                      ``n_params`` or a ``GPParams`` object.
+        :type theta: ndarray or GPParams
+        :returns: None
+        """
+
         self._check_theta(theta)
+        self._clear_fit_cache()
 
-        m = self.priors.mean.dm_dot_b(self._dm)
-        K = self.get_K_matrix()
+        self.Kinv, newnugget = cholesky_factor(self.get_K_matrix(), self.theta.nugget, self._nugget_type,
+                                               out=self._get_chol_buffer())
 
-        self.Kinv, newnugget = cholesky_factor(K, self.theta.nugget, self._nugget_type)
-        self.Ainv = calc_Ainv(self.Kinv, self._dm, self.priors.mean)
-        
         if self._nugget_type == "adaptive":
             self.theta.nugget = newnugget
 
+    def _share_covariance(self, other, theta):
+        """Sets the parameters and uses the covariance factorized by another emulator
+
+        Alternative to ``_fit_covariance`` for an emulator that has the
+        same inputs, kernel, and nugget as ``other``, which has
+        already factorized the covariance matrix for the values of the
+        hyperparameters in ``theta``. The factorized covariance matrix
+        and the cached values used in computing the derivatives of the
+        log-posterior (including the covariance matrix itself) are
+        shared with ``other`` rather than being computed again.
+
+        :param other: Emulator that has factorized the covariance
+                      matrix for ``theta``
+        :type other: GaussianProcess
+        :param theta: Values of the hyperparameters. Must be a numpy
+                      array with length ``n_params``.
+        :type theta: ndarray
+        :returns: None
+        """
+
+        self._check_theta(theta)
+        self._clear_fit_cache()
+
+        self.Kinv = other.Kinv
+        self._deriv_cache = other._deriv_cache
+
+        if self._nugget_type == "adaptive":
+            self.theta.nugget = other.theta.nugget
+
+    def _clear_fit_cache(self):
+        "Clear the cached values that depend on the current fit"
+
+        self._predict_cache = []
+        self._predict_factors = None
+        self._deriv_cache = {}
+
+    def _fit_targets(self):
+        """Computes the mean and log-posterior from the factorized covariance
+
+        Second step of ``fit``, which must be called after the
+        covariance matrix has been factorized by ``_fit_covariance`` or
+        ``_share_covariance``.
+
+        :returns: None
+        """
+
+        m = self.priors.mean.dm_dot_b(self._dm)
+
+        self.Ainv = calc_Ainv(self.Kinv, self._dm, self.priors.mean)
+
         self.Kinv_t = self.Kinv.solve(self.targets - m)
         H_Kinv_t = np.dot(self._dm.T, self.Kinv_t)
         
@@ -708,6 +896,33 @@ class GaussianProcess(GaussianProcessBase):
 
         return self.current_logpost
 
+    def _Kinv_logdet_deriv(self, key, dKdtheta):
+        """Derivative of the log-determinant of the covariance matrix
+
+        Computes (or looks up) the derivative of the log-determinant
+        of the covariance with respect to a group of hyperparameters.
+        This is the most expensive part of the gradient and only
+        depends on the covariance, so it is cached until the emulator
+        is next fit, and is shared by emulators that use the same
+        covariance matrix.
+
+        :param key: Name of the group of hyperparameters
+        :type key: str
+        :param dKdtheta: Derivative of the covariance matrix with
+                         respect to the hyperparameters in the group,
+                         with shape ``(n_group, n, n)``
+        :type dKdtheta: ndarray
+        :returns: Derivative of the log-determinant
+        :rtype: ndarray
+        """
+
+        key = "logdet_" + key
+
+        if not key in self._deriv_cache:
+            self._deriv_cache[key] = logdet_deriv(self.Kinv, dKdtheta)
+
+        return self._deriv_cache[key]
+
     def logpost_deriv(self, theta):
         """Calculate the partial derivatives of the negative log-posterior
 
@@ -740,8 +955,11 @@ class GaussianProcess(GaussianProcessBase):
 
         partials = np.zeros(self.n_params)
 
-        dKdtheta = self.theta.cov*self.kernel.kernel_deriv(self.inputs, self.inputs,
-                                                           self.theta.corr_raw)
+        if not "dKdtheta" in self._deriv_cache:
+            self._deriv_cache["dKdtheta"] = self.theta.cov*self.kernel.kernel_deriv(self.inputs, self.inputs,
+                                                                                    self.theta.corr_raw,
+                                                                                    sqdiff=self._get_sqdiff())
+        dKdtheta = self._deriv_cache["dKdtheta"]
         dAdtheta = calc_A_deriv(self.Kinv, self._dm, dKdtheta)
         
         Kinv_H_Ainv_H_Kinv_t = self.Kinv.solve(np.dot(self._dm,
@@ -753,17 +971,22 @@ class GaussianProcess(GaussianProcessBase):
                                                     np.dot(dKdtheta, Kinv_H_Ainv_H_Kinv_t).T) -
                                        np.dot(Kinv_H_Ainv_H_Kinv_t,
                                                  np.dot(dKdtheta, Kinv_H_Ainv_H_Kinv_t).T) +
-                                       logdet_deriv(self.Kinv, dKdtheta) +
+                                       self._Kinv_logdet_deriv("theta", dKdtheta) +
                                        logdet_deriv(self.Ainv, dAdtheta))
         
-        dKdcov = np.reshape(self.get_K_matrix(), (1, self.n, self.n))
+        # the covariance matrix is only needed here, so it is computed when the
+        # derivatives are first needed rather than being held after every fit
+        if not "K" in self._deriv_cache:
+            self._deriv_cache["K"] = self.get_K_matrix()
+
+        dKdcov = np.reshape(self._deriv_cache["K"], (1, self.n, self.n))
         dAdcov = calc_A_deriv(self.Kinv, self._dm, dKdcov)
         partials[self.n_corr] = 0.5*(-np.dot(self.Kinv_t, np.dot(dKdcov[0], self.Kinv_t)) +
                                       2.*np.dot(self.Kinv_t,
                                                 np.dot(dKdcov[0], Kinv_H_Ainv_H_Kinv_t)) -
                                       np.dot(Kinv_H_Ainv_H_Kinv_t,
                                              np.dot(dKdcov[0], Kinv_H_Ainv_H_Kinv_t)) +
-                                      logdet_deriv(self.Kinv, dKdcov) +
+                                      self._Kinv_logdet_deriv("cov", dKdcov) +
                                       logdet_deriv(self.Ainv, dAdcov))
                                        
         if self.nugget_type == "fit":
@@ -774,7 +997,7 @@ class GaussianProcess(GaussianProcessBase):
                                                           Kinv_H_Ainv_H_Kinv_t) -
                                              np.dot(Kinv_H_Ainv_H_Kinv_t,
                                                        Kinv_H_Ainv_H_Kinv_t) +
-                                             logdet_deriv(self.Kinv, dKdnugget) +
+                                             self._Kinv_logdet_deriv("nugget", dKdnugget) +
                                              logdet_deriv(self.Ainv, dAdnugget))
 
         partials -= self._priors.dlogpdtheta(self.theta)
@@ -884,18 +1107,84 @@ class GaussianProcess(GaussianProcessBase):
 
         testing = self._process_inputs(testing)
 
+        inputderiv = None
+        if deriv:
+            warnings.warn("Prediction derivatives have been deprecated and are no longer supported",
+                          DeprecationWarning)
+
+        mu, var = self._predict(testing, unc, include_nugget, full_cov)
+
+        return PredictResult(mean=mu, unc=var, deriv=inputderiv)
+
+    def _predict(self, testing, unc, include_nugget, full_cov, corr=None, check_cache=True):
+        """Compute the predictive mean and uncertainty for processed inputs
+
+        Does the computation for the ``predict`` method, once the
+        inputs have been checked and reshaped and the hyperparameters
+        are known to be fit. The correlation matrix between the
+        emulator inputs and the prediction points (the kernel
+        evaluated using the correlation length hyperparameters) can
+        optionally be passed in, which allows ``MultiOutputGP`` to
+        compute it once for all emulators that share the same kernel
+        and correlation lengths.
+
+        :param testing: Points where predictions will be made, with
+                        shape ``(n_predict, D)``
+        :type testing: ndarray
+        :param unc: Flag indicating if the uncertainties are to be
+                    computed.
+        :type unc: bool
+        :param include_nugget: Flag indicating if the nugget should be
+                               included in the predictive variance.
+        :type include_nugget: bool
+        :param full_cov: Flag indicating if the full covariance should
+                         be computed for the uncertainty.
+        :type full_cov: bool
+        :param corr: (optional) Precomputed correlation matrix between
+                     the emulator inputs and the prediction points,
+                     with shape ``(n, n_predict)``. Default is
+                     ``None``, in which case it is computed here.
+        :type corr: ndarray or None
+        :param check_cache: (optional) Flag indicating if cached
+                            predictions should be looked up. Can be
+                            set to ``False`` by a caller that has
+                            already done the lookup. Default is
+                            ``True``.
+        :type check_cache: bool
+        :returns: Tuple holding the predictive mean and the
+                  uncertainty (``None`` if ``unc`` is ``False``)
+        :rtype: tuple
+        """
+
+        if check_cache:
+            cached = self._get_cached_predict(testing, unc, include_nugget, full_cov)
+            if not cached is None:
+                return cached
+
+        dtype = self._predict_dtype
+        Kinv, Kinv_t_mean = self._get_predict_factors()
+
         dmtest = self.get_design_matrix(testing)
         mtest = np.dot(dmtest, self.theta.mean)
-        Ktest = self.get_cov_matrix(testing)
+        if corr is None:
+            Ktest = self.get_cov_matrix(testing)
+        else:
+            assert corr.shape == (self.n, testing.shape[0]), "bad shape for corr"
+            Ktest = self.theta.cov*corr
+        Ktest = Ktest.astype(dtype, copy=False)
 
-        mu = mtest + np.dot(Ktest.T, self.Kinv_t_mean)
+        mu = (mtest + np.dot(Ktest.T, Kinv_t_mean)).astype(dtype, copy=False)
 
         var = None
         if unc:
 
-            Kinv_Ktest = self.Kinv.solve(Ktest)
-            R = calc_R(Kinv_Ktest, self._dm, dmtest)
-            
+            # a single triangular solve gives both the correction to the
+            # prior variance and (with the design matrix solved against the
+            # same factor) the R matrix for the mean function uncertainty
+            Linv_Ktest = Kinv.solve_L(Ktest)
+            R = dmtest.T - np.dot(Kinv.solve_L(self._dm).T, Linv_Ktest)
+            LAinv_R = self.Ainv.solve_L(R)
+
             if full_cov:
                 sigma_2 = self.theta.cov*self.kernel.kernel_f(
                     testing, testing, self.theta.corr_raw
@@ -903,28 +1192,88 @@ class GaussianProcess(GaussianProcessBase):
                 
                 if include_nugget and not self.nugget_type == "pivot":
                     sigma_2 += np.eye(testing.shape[0])*self.theta.nugget
-                
-                Linv_Ktest = self.Kinv.solve_L(Ktest)
-                LAinv_R = self.Ainv.solve_L(R)
-                
+
                 var = (sigma_2 - np.dot(Linv_Ktest.T, Linv_Ktest) +
-                                 np.dot(LAinv_R.T, LAinv_R))
+                                 np.dot(LAinv_R.T, LAinv_R)).astype(dtype, copy=False)
             else:
                 sigma_2 = self.theta.cov
 
                 if include_nugget and not self.nugget_type == "pivot":
                     sigma_2 += self.theta.nugget
                     
-                var = np.maximum(sigma_2 - np.sum(Ktest*Kinv_Ktest, axis=0) +
-                                 np.sum(R*self.Ainv.solve(R), axis=0),
-                                 0.)
+                var = np.maximum(sigma_2 - np.einsum("ij,ij->j", Linv_Ktest, Linv_Ktest) +
+                                 np.einsum("ij,ij->j", LAinv_R, LAinv_R),
+                                 0.).astype(dtype, copy=False)
 
-        inputderiv = None
-        if deriv:
-            warnings.warn("Prediction derivatives have been deprecated and are no longer supported",
-                          DeprecationWarning)
+        if not self._cache_predictions or full_cov:
+            return mu, var
 
-        return PredictResult(mean=mu, unc=var, deriv=inputderiv)
+        self._predict_cache.append((self._predict_key(unc, include_nugget, full_cov),
+                                    np.array(testing), mu, var))
+        del self._predict_cache[:-_PREDICT_CACHE_SIZE]
+
+        return mu.copy(), (None if var is None else var.copy())
+
+    def _predict_key(self, unc, include_nugget, full_cov):
+        "Returns the options and hyperparameters that a cached prediction depends on"
+
+        return (unc, include_nugget, full_cov, self._predict_dtype,
+                self.theta.get_data().tobytes())
+
+    def _get_predict_factors(self):
+        """Returns the factorized covariance and weights used for predictions
+
+        Fitting is always done in double precision, but predictions
+        can be made in the precision given by ``_predict_dtype``
+        (set by ``MultiOutputGP`` through its ``dtype`` argument).
+        If this is not double precision, the factorized covariance
+        matrix and the product of its inverse with the targets minus
+        the mean are converted once after fitting and held until the
+        emulator is next fit, so that the triangular solves and
+        products done when predicting use the faster single
+        precision routines.
+
+        :returns: Factorized covariance matrix and the inverse
+                  covariance times the targets minus the mean
+        :rtype: tuple
+        """
+
+        if self._predict_dtype == np.float64:
+            return self.Kinv, self.Kinv_t_mean
+
+        if self._predict_factors is None:
+            self._predict_factors = (self.Kinv.astype(self._predict_dtype),
+                                     self.Kinv_t_mean.astype(self._predict_dtype))
+
+        return self._predict_factors
+
+    def _get_cached_predict(self, testing, unc, include_nugget, full_cov):
+        """Look up a recent prediction made for the same points and options
+
+        If ``cache_predictions`` is set, each emulator holds the last
+        few predictions that it has made (up to
+        ``_PREDICT_CACHE_SIZE``), along with a copy of the prediction
+        points so that a point array that has been modified in place
+        is not mistaken for the original. The cache is cleared
+        whenever the emulator is fit.
+
+        :param testing: Points where predictions will be made, with
+                        shape ``(n_predict, D)``
+        :type testing: ndarray
+        :returns: Tuple holding copies of the cached predictive mean
+                  and uncertainty, or ``None`` if there is no cached
+                  prediction for these points
+        :rtype: tuple or None
+        """
+
+        key = self._predict_key(unc, include_nugget, full_cov)
+
+        for (cached_key, cached_testing, mu, var) in reversed(self._predict_cache):
+            if (cached_key == key and cached_testing.shape == testing.shape and
+                np.array_equal(cached_testing, testing)):
+                return mu.copy(), (None if var is None else var.copy())
+
+        return None
 
     def __call__(self, testing):
         """A Gaussian process object is callable: calling it is the same as
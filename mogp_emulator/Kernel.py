@@ -6,9 +6,73 @@ length (``UniformSqExp``, ``UniformMat52``) or correlation lengths
 for each input dimension (``SquaredExponential``, ``Matern52``).
 The product form of the Matern 5/2 kernel (``ProductMat52``) is
 also available.
+
+If ``numba`` is installed, the scaled squared distances between two
+different sets of points (needed when making predictions) are computed
+with a compiled kernel that avoids creating the intermediate array of
+squared differences along each input dimension. Otherwise, they are
+computed with the C routines in ``scipy.spatial.distance``.
 """
 
 import numpy as np
+from scipy.spatial.distance import cdist
+
+try:
+    from numba import njit
+    numba_available = True
+except ImportError:
+    numba_available = False
+
+if numba_available:
+    # not compiled with parallel=True, as the numba threading layer is not safe
+    # to use with the fork-based multiprocessing used by MultiOutputGP
+
+    @njit(cache=True, nogil=True, fastmath={"contract", "reassoc"})
+    def _calc_scaled_r2_numba(x1, x2, weights):
+        "compiled computation of the weighted squared distances between all pairs of points"
+
+        n1, D = x1.shape
+        n2 = x2.shape[0]
+
+        r2 = np.empty((n1, n2))
+
+        for i in range(n1):
+            for j in range(n2):
+                total = 0.
+                for k in range(D):
+                    diff = x1[i, k] - x2[j, k]
+                    total += weights[k]*diff*diff
+                r2[i, j] = total
+
+        return r2
+
+def _calc_scaled_r2(x1, x2, weights):
+    r"""
+    Compute weighted squared distances between all pairs of points
+
+    Computes :math:`{\sum_k w_k(x_{1,ik} - x_{2,jk})^2}` for all pairs of
+    points in ``x1`` and ``x2``. Uses the compiled version if ``numba`` is
+    available, otherwise falls back to ``cdist`` after scaling each input
+    dimension by the square root of its weight (the weights are always
+    positive, as they are the exponential of the correlation parameters).
+
+    :param x1: First input array with shape ``(n1, D)``
+    :type x1: ndarray
+    :param x2: Second input array with shape ``(n2, D)``
+    :type x2: ndarray
+    :param weights: Weights for each input dimension, array with shape ``(D,)``
+    :type weights: ndarray
+    :returns: Array of weighted squared distances with shape ``(n1, n2)``
+    :rtype: ndarray
+    """
+
+    if numba_available:
+        return _calc_scaled_r2_numba(np.ascontiguousarray(x1, dtype=np.float64),
+                                     np.ascontiguousarray(x2, dtype=np.float64),
+                                     np.ascontiguousarray(weights, dtype=np.float64))
+    else:
+        scale = np.sqrt(weights)
+        return cdist(x1*scale, x2*scale, "sqeuclidean")
 
 class KernelBase(object):
     "Base Kernel"
@@ -96,7 +160,54 @@ class KernelBase(object):
 
         return x1, n1, x2, n2, params, D
 
-    def kernel_f(self, x1, x2, params):
+    def calc_sqdiff(self, x1, x2):
+        r"""
+        Calculate squared differences between all pairs of points along each input
+
+        This method computes the unscaled squared difference between all pairs of points
+        in ``x1`` and ``x2`` separately along each input dimension. The result does not
+        depend on the hyperparameters, so it can be computed once for a given set of
+        inputs and passed to the kernel methods through the ``sqdiff`` argument to
+        avoid recomputing the differences each time the hyperparameters change.
+
+        The differences for each input dimension are held in a separate contiguous
+        ``(n1, n2)`` block, computed from a contiguous copy of the corresponding
+        column of each input array. This is the same layout as the derivatives of
+        the distance with respect to the hyperparameters, and lets the weighted sum
+        over dimensions run over whole blocks rather than gathering strided values.
+
+        :param x1: First input array. Must be a 2-D array with shape ``(n1, D)``.
+        :type x1: array-like
+        :param x2: Second input array. Must be a 2-D array with shape ``(n2, D)``.
+        :type x2: array-like
+        :returns: Array holding the squared differences along each dimension. Will be
+                  an array with shape ``(D, n1, n2)``.
+        :rtype: ndarray
+        """
+
+        x1 = np.asarray(x1)
+        x2 = np.asarray(x2)
+
+        assert x1.ndim == 2, "x1 must be a 2-D array"
+        assert x2.ndim == 2, "x2 must be a 2-D array"
+        assert x1.shape[1] == x2.shape[1], "Input arrays do not have the same number of inputs"
+
+        x1_cols = np.ascontiguousarray(x1.T, dtype=np.float64)
+        x2_cols = np.ascontiguousarray(x2.T, dtype=np.float64)
+
+        sqdiff = np.empty((x1.shape[1], x1.shape[0], x2.shape[0]))
+
+        for (x1_col, x2_col, sqdiff_col) in zip(x1_cols, x2_cols, sqdiff):
+            np.subtract.outer(x1_col, x2_col, out=sqdiff_col)
+
+        return np.square(sqdiff, out=sqdiff)
+
+    def _check_sqdiff(self, sqdiff, x1, x2):
+        "Check that precomputed squared differences match the provided inputs"
+
+        assert sqdiff.shape == (x1.shape[1], x1.shape[0], x2.shape[0]), "bad shape for sqdiff"
+
+    def kernel_f(self, x1, x2, params, sqdiff=None):
         r"""
         Compute kernel values for a set of inputs
 
@@ -119,6 +230,11 @@ class KernelBase(object):
         :param params: Hyperparameter array. Must be 1-D with length one greater than
                        the last dimension of ``x1`` and ``x2``.
         :type params: array-like
+        :param sqdiff: (optional) Precomputed squared differences between ``x1`` and
+                       ``x2`` along each input dimension, as returned by ``calc_sqdiff``.
+                       If provided, avoids recomputing the differences between the
+                       inputs. Default is ``None``.
+        :type sqdiff: ndarray or None
         :returns: Array holding all kernel values between points in arrays ``x1``
                   and ``x2``. Will be an array with shape ``(n1, n2)``, where ``n1``
                   is the length of the first axis of ``x1`` and ``n2`` is the length
@@ -128,9 +244,9 @@ class KernelBase(object):
 
         x1, n1, x2, n2, params, D = self._check_inputs(x1, x2, params)
 
-        return self.calc_K(self.calc_r2(x1, x2, params))
+        return self.calc_K(self.calc_r2(x1, x2, params, sqdiff))
 
-    def kernel_deriv(self, x1, x2, params):
+    def kernel_deriv(self, x1, x2, params, sqdiff=None):
         r"""
         Compute kernel gradient for a set of inputs
 
@@ -153,6 +269,11 @@ class KernelBase(object):
         :param params: Hyperparameter array. Must be 1-D with length one greater than
                        the last dimension of ``x1`` and ``x2``.
         :type params: array-like
+        :param sqdiff: (optional) Precomputed squared differences between ``x1`` and
+                       ``x2`` along each input dimension, as returned by ``calc_sqdiff``.
+                       If provided, avoids recomputing the differences between the
+                       inputs. Default is ``None``.
+        :type sqdiff: ndarray or None
         :returns: Array holding the gradient of the kernel function between points in arrays
                   ``x1`` and ``x2`` with respect to the hyperparameters. Will be an array with
                   shape ``(D, n1, n2)``, where ``D`` is the length of ``params``, ``n1`` is the
@@ -164,9 +285,9 @@ class KernelBase(object):
 
         x1, n1, x2, n2, params, D = self._check_inputs(x1, x2, params)
 
-        dKdr2 = self.calc_dKdr2(self.calc_r2(x1, x2, params))
+        dKdr2 = self.calc_dKdr2(self.calc_r2(x1, x2, params, sqdiff))
 
-        dr2dtheta = self.calc_dr2dtheta(x1, x2, params)
+        dr2dtheta = self.calc_dr2dtheta(x1, x2, params, sqdiff)
 
         dKdtheta = dKdr2*dr2dtheta
 
@@ -293,7 +414,7 @@ class UniformKernel(KernelBase):
 
         return x1, n1, x2, n2, params, D
         
-    def calc_r2(self, x1, x2, params):
+    def calc_r2(self, x1, x2, params, sqdiff=None):
         r"""
         Calculate squared distance between all pairs of points
 
@@ -317,6 +438,11 @@ class UniformKernel(KernelBase):
         :param params: Hyperparameter array. Must be 1-D with length one greater than
                        the last dimension of ``x1`` and ``x2``.
         :type params: array-like
+        :param sqdiff: (optional) Precomputed squared differences between ``x1`` and
+                       ``x2`` along each input dimension, as returned by ``calc_sqdiff``.
+                       If provided, avoids recomputing the differences between the
+                       inputs. Default is ``None``.
+        :type sqdiff: ndarray or None
         :returns: Array holding all pair-wise squared distances between points in arrays ``x1``
                   and ``x2``. Will be an array with shape ``(n1, n2)``, where ``n1``
                   is the length of the first axis of ``x1`` and ``n2`` is the length
@@ -328,14 +454,18 @@ class UniformKernel(KernelBase):
         
         exp_theta = np.exp(params)[0]
 
-        r2_matrix = np.sum(exp_theta*(x1[:, np.newaxis, :] - x2[np.newaxis, :, :])**2, axis=-1)
+        if sqdiff is None:
+            r2_matrix = _calc_scaled_r2(x1, x2, np.full(x1.shape[1], exp_theta))
+        else:
+            self._check_sqdiff(sqdiff, x1, x2)
+            r2_matrix = exp_theta*np.sum(sqdiff, axis=0)
 
         if np.any(np.isinf(r2_matrix)):
             raise FloatingPointError("Inf enountered in kernel distance computation")
 
         return r2_matrix
         
-    def calc_dr2dtheta(self, x1, x2, params):
+    def calc_dr2dtheta(self, x1, x2, params, sqdiff=None):
         r"""
         Calculate the first derivative of the distance between all pairs of points with
         respect to the hyperparameters
@@ -361,6 +491,11 @@ class UniformKernel(KernelBase):
         :param params: Hyperparameter array. Must be 1-D with length one greater than
                        the last dimension of ``x1`` and ``x2``.
         :type params: array-like
+        :param sqdiff: (optional) Precomputed squared differences between ``x1`` and
+                       ``x2`` along each input dimension, as returned by ``calc_sqdiff``.
+                       If provided, avoids recomputing the differences between the
+                       inputs. Default is ``None``.
+        :type sqdiff: ndarray or None
         :returns: Array holding the derivative of the pair-wise distances between
                   points in arrays ``x1`` and ``x2`` with respect to the hyperparameters.
                   Will be an array with shape ``(D, n1, n2)``, where ``D`` is the length
@@ -373,7 +508,7 @@ class UniformKernel(KernelBase):
 
         x1, n1, x2, n2, params, D = self._check_inputs(x1, x2, params)
 
-        return np.reshape(self.calc_r2(x1, x2, params), (1, n1, n2))
+        return np.reshape(self.calc_r2(x1, x2, params, sqdiff), (1, n1, n2))
         
     def calc_d2r2dtheta2(self, x1, x2, params):
         r"""
@@ -441,7 +576,7 @@ class StationaryKernel(KernelBase):
     creating a new ``Kernel`` instance.
     """
 
-    def calc_r2(self, x1, x2, params):
+    def calc_r2(self, x1, x2, params, sqdiff=None):
         r"""
         Calculate squared distance between all pairs of points
 
@@ -466,6 +601,11 @@ class StationaryKernel(KernelBase):
         :param params: Hyperparameter array. Must be 1-D with length one greater than
                        the last dimension of ``x1`` and ``x2``.
         :type params: array-like
+        :param sqdiff: (optional) Precomputed squared differences between ``x1`` and
+                       ``x2`` along each input dimension, as returned by ``calc_sqdiff``.
+                       If provided, avoids recomputing the differences between the
+                       inputs. Default is ``None``.
+        :type sqdiff: ndarray or None
         :returns: Array holding all pair-wise squared distances between points in arrays ``x1``
                   and ``x2``. Will be an array with shape ``(n1, n2)``, where ``n1``
                   is the length of the first axis of ``x1`` and ``n2`` is the length
@@ -477,14 +617,18 @@ class StationaryKernel(KernelBase):
         
         exp_theta = np.exp(params)
 
-        r2_matrix = np.sum(exp_theta*(x1[:, np.newaxis, :] - x2[np.newaxis, :, :])**2, axis=-1)
+        if sqdiff is None:
+            r2_matrix = _calc_scaled_r2(x1, x2, exp_theta)
+        else:
+            self._check_sqdiff(sqdiff, x1, x2)
+            r2_matrix = np.tensordot(exp_theta, sqdiff, axes=1)
 
         if np.any(np.isinf(r2_matrix)):
             raise FloatingPointError("Inf enountered in kernel distance computation")
 
         return r2_matrix
 
-    def calc_dr2dtheta(self, x1, x2, params):
+    def calc_dr2dtheta(self, x1, x2, params, sqdiff=None):
         r"""
         Calculate the first derivative of the distance between all pairs of points with
         respect to the hyperparameters
@@ -510,6 +654,11 @@ class StationaryKernel(KernelBase):
         :param params: Hyperparameter array. Must be 1-D with length one greater than
                        the last dimension of ``x1`` and ``x2``.
         :type params: array-like
+        :param sqdiff: (optional) Precomputed squared differences between ``x1`` and
+                       ``x2`` along each input dimension, as returned by ``calc_sqdiff``.
+                       If provided, avoids recomputing the differences between the
+                       inputs. Default is ``None``.
+        :type sqdiff: ndarray or None
         :returns: Array holding the derivative of the pair-wise distances between
                   points in arrays ``x1`` and ``x2`` with respect to the hyperparameters.
                   Will be an array with shape ``(D, n1, n2)``, where ``D`` is the length
@@ -524,8 +673,12 @@ class StationaryKernel(KernelBase):
 
         exp_theta = np.exp(params)
 
-        dr2dtheta = np.transpose(exp_theta*(x1[:, np.newaxis, :] - x2[np.newaxis, :, :])**2,
-                                 (2, 0, 1))
+        if sqdiff is None:
+            sqdiff = self.calc_sqdiff(x1, x2)
+        else:
+            self._check_sqdiff(sqdiff, x1, x2)
+
+        dr2dtheta = exp_theta[:, np.newaxis, np.newaxis]*sqdiff
 
         return dr2dtheta
 
@@ -581,7 +734,7 @@ class StationaryKernel(KernelBase):
 class ProductKernel(KernelBase):
     "Product form of kernel"
     
-    def calc_r2(self, x1, x2, params):
+    def calc_r2(self, x1, x2, params, sqdiff=None):
         r"""
         Calculate squared distance between all pairs of points
 
@@ -606,6 +759,11 @@ class ProductKernel(KernelBase):
         :param params: Hyperparameter array. Must be 1-D with length one greater than
                        the last dimension of ``x1`` and ``x2``.
         :type params: array-like
+        :param sqdiff: (optional) Precomputed squared differences between ``x1`` and
+                       ``x2`` along each input dimension, as returned by ``calc_sqdiff``.
+                       If provided, avoids recomputing the differences between the
+                       inputs. Default is ``None``.
+        :type sqdiff: ndarray or None
         :returns: Array holding all pair-wise squared distances between points in arrays ``x1``
                   and ``x2``. Will be an array with shape ``(D, n1, n2)``, where ``D`` is
                   the number of dimensions, ``n1`` is the length of the first axis of
@@ -617,14 +775,19 @@ class ProductKernel(KernelBase):
         
         exp_theta = np.exp(params)
 
-        r2_matrix = exp_theta[np.newaxis, np.newaxis, :]*(x1[:, np.newaxis, :] - x2[np.newaxis, :, :])**2
+        if sqdiff is None:
+            sqdiff = self.calc_sqdiff(x1, x2)
+        else:
+            self._check_sqdiff(sqdiff, x1, x2)
+
+        r2_matrix = np.moveaxis(exp_theta[:, np.newaxis, np.newaxis]*sqdiff, 0, -1)
 
         if np.any(np.isinf(r2_matrix)):
             raise FloatingPointError("Inf enountered in kernel distance computation")
 
         return r2_matrix
     
-    def kernel_f(self, x1, x2, params):
+    def kernel_f(self, x1, x2, params, sqdiff=None):
         r"""
         Compute kernel values for a set of inputs
 
@@ -647,6 +810,11 @@ class ProductKernel(KernelBase):
         :param params: Hyperparameter array. Must be 1-D with length one greater than
                        the last dimension of ``x1`` and ``x2``.
         :type params: array-like
+        :param sqdiff: (optional) Precomputed squared differences between ``x1`` and
+                       ``x2`` along each input dimension, as returned by ``calc_sqdiff``.
+                       If provided, avoids recomputing the differences between the
+                       inputs. Default is ``None``.
+        :type sqdiff: ndarray or None
         :returns: Array holding all kernel values between points in arrays ``x1``
                   and ``x2``. Will be an array with shape ``(n1, n2)``, where ``n1``
                   is the length of the first axis of ``x1`` and ``n2`` is the length
@@ -656,9 +824,9 @@ class ProductKernel(KernelBase):
 
         x1, n1, x2, n2, params, D = self._check_inputs(x1, x2, params)
 
-        return np.prod(self.calc_K(self.calc_r2(x1, x2, params)), axis=-1)
+        return np.prod(self.calc_K(self.calc_r2(x1, x2, params, sqdiff)), axis=-1)
         
-    def kernel_deriv(self, x1, x2, params):
+    def kernel_deriv(self, x1, x2, params, sqdiff=None):
         r"""
         Compute kernel gradient for a set of inputs
 
@@ -681,6 +849,11 @@ class ProductKernel(KernelBase):
         :param params: Hyperparameter array. Must be 1-D with length one greater than
                        the last dimension of ``x1`` and ``x2``.
         :type params: array-like
+        :param sqdiff: (optional) Precomputed squared differences between ``x1`` and
+                       ``x2`` along each input dimension, as returned by ``calc_sqdiff``.
+                       If provided, avoids recomputing the differences between the
+                       inputs. Default is ``None``.
+        :type sqdiff: ndarray or None
         :returns: Array holding the gradient of the kernel function between points in arrays
                   ``x1`` and ``x2`` with respect to the hyperparameters. Will be an array with
                   shape ``(D, n1, n2)``, where ``D`` is the length of ``params``, ``n1`` is the
@@ -692,7 +865,7 @@ class ProductKernel(KernelBase):
 
         x1, n1, x2, n2, params, D = self._check_inputs(x1, x2, params)
 
-        r2_matrix = self.calc_r2(x1, x2, params)
+        r2_matrix = self.calc_r2(x1, x2, params, sqdiff)
         
         diag = self.calc_dKdr2(r2_matrix)*r2_matrix
         
@@ -1,15 +1,31 @@
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from multiprocessing import Pool
+import os
 import platform
+import warnings
 import numpy as np
 from mogp_emulator.GaussianProcess import (
     GaussianProcessBase,
     GaussianProcess,
     PredictResult
 )
-from mogp_emulator.Kernel import KernelBase
+from mogp_emulator.Kernel import KernelBase, numba_available
 from mogp_emulator.Priors import GPPriors
 from patsy import ModelDesc
 
+# multi-output predictions for up to this many emulators are made in serial
+# unless the number of processes or the backend are given explicitly, as the
+# per-emulator linear algebra already makes good use of BLAS while the cost
+# of starting a pool dominates when there are only a few emulators
+
+_SERIAL_PREDICT_MAX_EMULATORS = 32
+
+# largest number of elements in the squared differences between the inputs
+# and the prediction points that is precomputed to share between emulators
+
+_SERIAL_PREDICT_MAX_SQDIFF = 2**24
+
 class MultiOutputGPBase(object):
     """Base class for Multi-Output GPs. CPU and GPU versions derive from
     this class.
@@ -35,10 +51,21 @@ class MultiOutputGP(MultiOutputGPBase):
     alternatively be a list of values with length matching the number
     of emulators to set those values individually.
 
+    The ``dtype`` argument sets the floating point precision used when
+    making predictions, and can be ``np.float64`` (the default) or
+    ``np.float32``. Hyperparameters are always fit in double precision,
+    as the optimization is poorly conditioned otherwise, but in single
+    precision the fit covariance factors are converted once after
+    fitting and predictions are computed and returned as
+    ``np.float32`` arrays. This roughly halves the memory traffic of
+    the triangular solves that dominate the cost of predicting with
+    many training points, at the cost of a relative accuracy of about
+    ``1.e-6`` in the predictions.
+
     """
 
     def __init__(self, inputs, targets, mean=None, kernel="SquaredExponential", priors=None,
-                 nugget="adaptive", inputdict={}, use_patsy=True):
+                 nugget="adaptive", inputdict={}, use_patsy=True, dtype=np.float64):
         """
         Create a new multi-output GP Emulator
         """ 
@@ -52,8 +79,8 @@ class MultiOutputGP(MultiOutputGPBase):
                           "matrices in mogp-emulator. The use_patsy=False option will be ignored.")
 
         # check input types and shapes, reshape as appropriate for the case of a single emulator
-        inputs = np.array(inputs)
-        targets = np.array(targets)
+        inputs = np.asarray(inputs)
+        targets = np.asarray(targets)
         if len(inputs.shape) == 1:
             inputs = np.reshape(inputs, (-1, 1))
         if len(targets.shape) == 1:
@@ -100,9 +127,47 @@ class MultiOutputGP(MultiOutputGPBase):
         assert isinstance(nugget, list), "nugget must be a string, float, or a list of strings and floats"
         assert len(nugget) == self.n_emulators
 
-        self.emulators = [ GaussianProcess(inputs, single_target, m, k, p, n)
-                           for (single_target, m, k, p, n) in zip(targets, mean, kernel, priorslist, nugget)]
+        self._dtype = np.dtype(dtype)
+        assert self._dtype in (np.float32, np.float64), "dtype must be np.float32 or np.float64"
+
+        # all emulators share a single copy of the inputs, and targets for all
+        # emulators are held in a single contiguous array, with each emulator
+        # viewing its own row rather than holding a separate copy
+
+        self._inputs = np.array(inputs, dtype=np.float64)
+        self._inputs.flags.writeable = False
+
+        self._targets = np.array(targets, dtype=np.float64)
+        self._targets.flags.writeable = False
+
+        # all emulators share the same inputs, so the squared differences between
+        # the inputs only need to be computed once
+
+        self._sqdiff_cache = {}
+
+        self.emulators = [ GaussianProcess(self._inputs, single_target, m, k, p, n)
+                           for (single_target, m, k, p, n) in zip(self._targets, mean, kernel, priorslist, nugget)]
+
+        for idx in range(self.n_emulators):
+            self._link_emulator(idx)
+
+    def __getstate__(self):
+        "Drop the shared squared differences when pickling, as they are cheap to recompute"
+
+        state = self.__dict__.copy()
+        state["_sqdiff_cache"] = {}
+        return state
+
+    def __setstate__(self, state):
+        "Restore the data shared by all emulators after unpickling"
+
+        self.__dict__.update(state)
+
+        self._inputs.flags.writeable = False
+        self._targets.flags.writeable = False
 
+        for idx in range(self.n_emulators):
+            self._link_emulator(idx)
 
     @property
     def inputs(self):
@@ -114,7 +179,7 @@ class MultiOutputGP(MultiOutputGPBase):
         :returns: Array of input values
         :rtype: ndarray
         """
-        return self.emulators[0].inputs
+        return self._inputs
 
     @property
     def targets(self):
@@ -126,10 +191,7 @@ class MultiOutputGP(MultiOutputGPBase):
         :returns: Array of target values
         :rtype: ndarray
         """
-        targetlist = []
-        for em in self.emulators:
-            targetlist.append(em.targets)
-        return np.array(targetlist)
+        return self._targets
 
     @property
     def D(self):
@@ -168,6 +230,49 @@ class MultiOutputGP(MultiOutputGPBase):
     def n_emulators(self):
         return self._n_emulators
 
+    @property
+    def cache_predictions(self):
+        """Flag indicating if the emulators cache their predictions
+
+        Returns ``True`` if all emulators cache their predictions (see
+        ``GaussianProcess.cache_predictions``). Setting this sets the
+        flag for all emulators. ``False`` by default.
+
+        :returns: Flag indicating if predictions are cached
+        :rtype: bool
+        """
+        return all([em.cache_predictions for em in self.emulators])
+
+    @cache_predictions.setter
+    def cache_predictions(self, cache_predictions):
+        for em in self.emulators:
+            em.cache_predictions = cache_predictions
+
+    def _link_emulator(self, index):
+        """Point an emulator at the data shared by all emulators
+
+        Sets the inputs of the emulator with the given index to be the
+        shared inputs array and its targets to be a view of the
+        corresponding row of the shared targets array, sets
+        its squared input differences cache to the one shared by all
+        emulators, and sets the precision it uses for predictions. This is done when the emulators are created, and
+        must be redone whenever an emulator is replaced by a copy (i.e.
+        one returned from a pool worker after fitting in parallel).
+
+        :param index: index of the emulator to link to the shared data
+        :type index: int
+        :returns: None
+        """
+
+        em = self.emulators[index]
+        assert np.array_equal(em.inputs, self._inputs), "emulator inputs do not match"
+        assert np.array_equal(em.targets, self._targets[index]), "emulator targets do not match"
+
+        em._inputs = self._inputs
+        em._targets = self._targets[index]
+        em._sqdiff_cache = self._sqdiff_cache
+        em._predict_dtype = self._dtype
+
     def reset_fit_status(self):
         """Reset the fit status of all emulators
         """
@@ -180,7 +285,7 @@ class MultiOutputGP(MultiOutputGPBase):
         return self.emulators[0]._process_inputs(inputs)
 
     def predict(self, testing, unc=True, deriv=False, include_nugget=True,
-                full_cov = False, allow_not_fit=False, processes=None):
+                full_cov = False, allow_not_fit=False, processes=None, backend=None):
         """Make a prediction for a set of input vectors
 
         Makes predictions for each of the emulators on a given set of
@@ -227,7 +332,18 @@ class MultiOutputGP(MultiOutputGPBase):
 
         As with the fitting, this computation can be done
         independently for each emulator and thus can be done in
-        parallel.
+        parallel (though if there are only a few emulators or only
+        one process is requested, the predictions are made in serial,
+        as starting the workers costs more than is gained). The ``backend`` argument selects whether this uses
+        a pool of threads (``"thread"``) or of processes
+        (``"process"``). Threads avoid the cost of starting processes
+        and pickling the emulators, and run concurrently as the bulk
+        of the prediction is done in compiled code that releases the
+        GIL. By default threads are used if the compiled kernel
+        routines are available (i.e. ``numba`` is installed), and
+        processes otherwise. The process backend is always run in
+        serial on Windows or if any emulator uses a patsy formula
+        mean function.
 
         :param testing: Array-like object holding the points where
                         predictions will be made.  Must have shape
@@ -259,8 +375,20 @@ class MultiOutputGP(MultiOutputGPBase):
                           making the predictions.  Must be a positive
                           integer or ``None`` to use the number of
                           processors on the computer (default is
-                          ``None``)
+                          ``None``). If this and ``backend`` are both
+                          ``None``, predictions for a small number of
+                          emulators are made in serial, as starting
+                          the workers would cost more than it saves.
+                          Predictions are always made in serial if
+                          ``processes`` is 1.
         :type processes: int or None
+        :param backend: (optional) Parallel backend to use for making
+                        the predictions. Must be ``"thread"``,
+                        ``"process"``, or ``None`` to select the
+                        default (``"thread"`` if ``numba`` is
+                        installed, otherwise ``"process"``). Default
+                        is ``None``.
+        :type backend: str or None
         :returns: ``PredictResult`` object holding numpy arrays
                   containing the predictions, uncertainties, and
                   derivatives, respectively. Predictions and
@@ -273,7 +401,7 @@ class MultiOutputGP(MultiOutputGPBase):
 
         """
 
-        testing = np.array(testing)
+        testing = np.ascontiguousarray(testing, dtype=np.float64)
         if self.D == 1 and testing.ndim == 1:
             testing = np.reshape(testing, (-1, 1))
         elif testing.ndim == 1:
@@ -291,32 +419,144 @@ class MultiOutputGP(MultiOutputGPBase):
             processes = int(processes)
             assert processes > 0, "number of processes must be a positive integer"
 
+        auto_parallel = processes is None and backend is None
+
+        backend = _get_backend(backend, "thread" if numba_available else "process")
+
         if allow_not_fit:
             predict_method = _gp_predict_default_NaN
         else:
             predict_method = GaussianProcess.predict
 
-        serial_predict = (platform.system() == "Windows" or
-                          any([isinstance(em._mean, ModelDesc) for em in self.emulators]))
+        serial_predict = ((auto_parallel and self.n_emulators <= _SERIAL_PREDICT_MAX_EMULATORS) or
+                          processes == 1 or
+                          (backend == "process" and
+                           (platform.system() == "Windows" or
+                            any([isinstance(em._mean, ModelDesc) for em in self.emulators]))))
+
+        # predictions are written into the output arrays as each emulator
+        # finishes, so the results for all emulators are never held twice.
+        # The deprecation warning for derivatives has been raised above,
+        # so the emulators are not asked for them.
+
+        predict_out = np.empty((self.n_emulators, n_testing), dtype=self._dtype)
+
+        unc_out = None
+        if unc:
+            if full_cov:
+                unc_out = np.empty((self.n_emulators, n_testing, n_testing), dtype=self._dtype)
+            else:
+                unc_out = np.empty((self.n_emulators, n_testing), dtype=self._dtype)
 
         if serial_predict:
-            predict_vals = [predict_method(gp, testing, unc, deriv, include_nugget, full_cov)
-                            for gp in self.emulators]
+            self._store_predictions(self._predict_serial(testing, predict_method, unc, False,
+                                                         include_nugget, full_cov),
+                                    predict_out, unc_out)
+        elif backend == "thread":
+            with ThreadPoolExecutor(processes) as executor:
+                self._store_predictions(enumerate(executor.map(lambda gp: predict_method(gp, testing, unc, False,
+                                                                                         include_nugget, full_cov),
+                                                               self.emulators)),
+                                        predict_out, unc_out)
         else:
-            with Pool(processes) as p:
-                predict_vals = p.starmap(predict_method,
-                                         [(gp, testing, unc, deriv, include_nugget, full_cov)
-                                          for gp in self.emulators])
+            with Pool(processes, initializer=_init_worker,
+                      initargs=({"emulators": self.emulators, "testing": testing},)) as p:
+                self._store_predictions(p.imap_unordered(partial(_predict_worker, predict_method=predict_method,
+                                                                 unc=unc, deriv=False,
+                                                                 include_nugget=include_nugget,
+                                                                 full_cov=full_cov),
+                                                         range(self.n_emulators),
+                                                         chunksize=_get_chunksize(self.n_emulators, processes)),
+                                        predict_out, unc_out)
+
+        return PredictResult(mean=predict_out, unc=unc_out, deriv=None)
+
+    def _store_predictions(self, predict_vals, predict_out, unc_out):
+        """Write the predictions for each emulator into the output arrays
+
+        :param predict_vals: Iterable yielding the index of an emulator
+                             and its predictions, in any order
+        :type predict_vals: iterable
+        :param predict_out: Array that the predicted means are written
+                            into, with first axis of length
+                            ``n_emulators``
+        :type predict_out: ndarray
+        :param unc_out: Array that the uncertainties are written into,
+                        with first axis of length ``n_emulators``, or
+                        ``None`` if the uncertainties are not computed
+        :type unc_out: ndarray or None
+        :returns: None
+        """
+
+        for (idx, result) in predict_vals:
+            predict_out[idx] = result[0]
+            if not unc_out is None:
+                unc_out[idx] = result[1]
+
+    def _predict_serial(self, testing, predict_method, unc, deriv, include_nugget, full_cov):
+        """Make predictions for all emulators in serial
+
+        Computes the predictions for each emulator in turn, sharing
+        the work that is common to several emulators. The squared
+        differences between the inputs and the prediction points are
+        computed once for all emulators (if not too large to hold in
+        memory, and if more than one correlation matrix is needed),
+        and emulators with the same kernel and correlation length
+        hyperparameters share the same correlation matrix, so that
+        only the emulator-specific linear algebra is repeated. Each
+        correlation matrix is computed when the first emulator in its
+        group is predicted and released once the group is done.
+        Emulators with a cached prediction for these points skip the
+        computation entirely.
+        Emulators that are not fit are passed to ``predict_method``,
+        which either raises an error or fills in the predictions
+        with ``NaN``.
+
+        :param testing: Points where predictions will be made, with
+                        shape ``(n_predict, D)``
+        :type testing: ndarray
+        :param predict_method: Function used to make predictions for
+                               any emulators that are not fit.
+        :type predict_method: function
+        :returns: Generator yielding the index of each emulator and a
+                  tuple holding its prediction, uncertainty, and
+                  derivatives
+        :rtype: generator
+        """
+
+        # emulators are grouped by kernel and correlation lengths, so that each
+        # correlation matrix is only held while the emulators sharing it make
+        # their predictions
 
-        # repackage predictions into numpy arrays
+        groups = {}
 
-        predict_unpacked, unc_unpacked, deriv_unpacked = [np.array(t) for t in zip(*predict_vals)]
+        for (idx, em) in enumerate(self.emulators):
+            if em.theta.get_data() is None:
+                yield idx, predict_method(em, testing, unc, deriv, include_nugget, full_cov)
+                continue
 
-        if not unc:
-            unc_unpacked = None
-        deriv_unpacked = None
+            cached = em._get_cached_predict(testing, unc, include_nugget, full_cov)
+            if not cached is None:
+                yield idx, cached + (None,)
+                continue
 
-        return PredictResult(mean=predict_unpacked, unc=unc_unpacked, deriv=deriv_unpacked)
+            key = (type(em.kernel), em.theta.corr_raw.tobytes())
+            groups.setdefault(key, []).append(idx)
+
+        sqdiff = None
+        if len(groups) > 1 and self.n*testing.shape[0]*self.D <= _SERIAL_PREDICT_MAX_SQDIFF:
+            sqdiff = self.emulators[0].kernel.calc_sqdiff(self.inputs, testing)
+
+        for indices in groups.values():
+            em = self.emulators[indices[0]]
+            corr = em.kernel.kernel_f(em.inputs, testing, em.theta.corr_raw, sqdiff=sqdiff)
+
+            for idx in indices:
+                mu, var = self.emulators[idx]._predict(testing, unc, include_nugget, full_cov, corr=corr,
+                                                       check_cache=False)
+                yield idx, (mu, var, None)
+
+            corr = None
 
     def __call__(self, testing, processes=None):
         """Interface to predict means by calling the object
@@ -473,6 +713,93 @@ class MultiOutputGP(MultiOutputGPBase):
                  str(self.D)+" input variables")
 
 
+def _get_backend(backend, default):
+    """Check the parallel backend used to predict or fit emulators
+
+    Validates the ``backend`` argument used to choose between running
+    the per-emulator computations in a pool of threads or a pool of
+    processes. Threads share the emulators directly and so avoid
+    process startup and pickling costs, but only run concurrently
+    when the work releases the GIL (as NumPy, LAPACK, and the
+    compiled kernel routines do).
+
+    :param backend: Name of the backend, either ``"thread"`` or
+                    ``"process"``, or ``None`` to use the default.
+    :type backend: str or None
+    :param default: Backend to use if ``backend`` is ``None``
+    :type default: str
+    :returns: Name of the backend to use
+    :rtype: str
+    """
+
+    if backend is None:
+        backend = default
+
+    assert backend in ("thread", "process"), "backend must be 'thread' or 'process'"
+
+    return backend
+
+_worker_state = {}
+
+def _init_worker(state):
+    """Initialize the shared state of a pool worker process
+
+    Passed as the ``initializer`` of a multiprocessing pool to hand
+    the data needed by every task (the emulators and any arrays that
+    are common to all of them) to each worker once, rather than
+    pickling it again for every task. Tasks then only need to carry
+    the index of the emulator they operate on. On platforms that
+    start workers by forking, the state is inherited without being
+    pickled at all.
+
+    :param state: Dictionary holding the data to be made available to
+                  the tasks run by this worker
+    :type state: dict
+    :returns: None
+    """
+
+    _worker_state.clear()
+    _worker_state.update(state)
+
+def _predict_worker(idx, predict_method, unc, deriv, include_nugget, full_cov):
+    """Make predictions with one emulator held in the worker state
+
+    Looks up the emulator with index ``idx`` and the testing points
+    in the state set up by ``_init_worker`` and calls the provided
+    prediction method on them. All other arguments are passed on
+    to the prediction method. Returns the index along with the
+    predictions, so that results can be collected in any order.
+    """
+
+    return idx, predict_method(_worker_state["emulators"][idx], _worker_state["testing"],
+                               unc, deriv, include_nugget, full_cov)
+
+def _get_chunksize(n_tasks, processes):
+    """Determine the chunk size for dispatching tasks to a pool
+
+    Groups tasks into chunks when dispatching them to a
+    multiprocessing pool, which reduces the interprocess
+    communication overhead when the number of emulators is large
+    relative to the number of processes. Aims for roughly four chunks
+    per process so that the load remains balanced if some emulators
+    take longer than others.
+
+    :param n_tasks: Number of tasks to be dispatched to the pool
+    :type n_tasks: int
+    :param processes: Number of processes in the pool, or ``None``
+                      if the pool uses the number of processors on the
+                      computer
+    :type processes: int or None
+    :returns: Chunk size to pass to the pool mapping methods (always
+              a positive integer)
+    :rtype: int
+    """
+
+    if processes is None:
+        processes = os.cpu_count() or 1
+
+    return max(1, n_tasks//processes//4)
+
 def _gp_predict_default_NaN(gp, testing, unc, deriv, include_nugget, full_cov):
     """Prediction method for GPs that defaults to NaN for unfit GPs
 
@@ -526,12 +853,14 @@ def _gp_predict_default_NaN(gp, testing, unc, deriv, include_nugget, full_cov):
     assert isinstance(gp, GaussianProcessBase)
 
     try:
-        return gp.predict(testing, unc, deriv, include_nugget)
+        return gp.predict(testing, unc, deriv, include_nugget, full_cov)
     except ValueError:
 
         n_predict = testing.shape[0]
 
-        if unc:
+        if unc and full_cov:
+            unc_array = np.full((n_predict, n_predict), np.nan)
+        elif unc:
             unc_array = np.array([np.nan]*n_predict)
         else:
             unc_array = None
@@ -2,6 +2,7 @@ import numpy as np
 import scipy.stats
 from scipy.linalg import LinAlgError
 from scipy.optimize import minimize
+from concurrent.futures import ThreadPoolExecutor
 from multiprocessing import Pool
 from functools import partial
 import platform
@@ -10,7 +11,19 @@ from mogp_emulator.GaussianProcess import GaussianProcessBase, GaussianProcess
 from mogp_emulator.GaussianProcessGPU import GaussianProcessGPU
 from mogp_emulator.MultiOutputGP_GPU import MultiOutputGP_GPU
 from mogp_emulator import LibGPGPU
-from mogp_emulator.MultiOutputGP import MultiOutputGP
+from mogp_emulator.MultiOutputGP import (
+    MultiOutputGP,
+    _get_backend,
+    _get_chunksize,
+    _init_worker,
+    _worker_state
+)
+
+# multi-output fits with up to this many emulators to fit are done in
+# serial unless the number of processes or the backend are given explicitly,
+# as starting the workers costs more than fitting so few emulators
+
+_SERIAL_FIT_MAX_EMULATORS = 2
 
 
 def fit_GP_MAP(*args, n_tries=15, theta0=None, method="L-BFGS-B",
@@ -75,6 +88,20 @@ def fit_GP_MAP(*args, n_tries=15, theta0=None, method="L-BFGS-B",
     that if you us a numpy array, all emulators must have the same
     number of parameters, while using a list allows more flexibility.
 
+    For ``MultiOutputGP`` fitting, the keyword ``shared_kernel=True``
+    fits the same hyperparameters for all emulators by minimizing the
+    sum of their negative log-likelihoods minus the log-prior of the
+    hyperparameters (taken from the first emulator being fit, and
+    counted only once). This is much faster when
+    there are many outputs, as the covariance matrix is only
+    factorized once for all emulators at each step of the
+    minimization, and is appropriate when the outputs are expected to
+    vary on similar length scales. All emulators must use the same
+    kernel and nugget, and ``theta0`` must be ``None`` or a single
+    numpy array of shape ``(n_params,)``. Fitting all emulators
+    individually afterwards with ``refit=True`` and the shared values
+    as ``theta0`` is often a good way to find a starting point.
+
     The user can specify the details of the minimization method, using
     any of the gradient-based optimizers available in
     ``scipy.optimize.minimize``. Any additional parameters beyond the
@@ -226,6 +253,41 @@ def _fit_single_GP_MAP(gp, n_tries=15, theta0=None, method='L-BFGS-B', **kwargs)
     """
 
     assert isinstance(gp, GaussianProcessBase)
+
+    release_sqdiff = gp._cache_sqdiff()
+
+    theta = _minimize_logpost(gp.logposterior, gp.logpost_deriv, gp.priors.sample,
+                              gp.n_params, n_tries, theta0, method, **kwargs)
+
+    if theta is None:
+        gp.theta = None
+    elif gp._refit(theta):
+        # the minimizer usually evaluates the best point last, in which case
+        # the GP already holds the fit state for it and refitting is wasted
+        gp.fit(theta)
+
+    # the covariance matrix and its derivatives, as well as the squared
+    # differences between the inputs, are only kept while fitting, and are
+    # recomputed if needed
+    gp._deriv_cache = {}
+    if release_sqdiff:
+        del gp._sqdiff_cache["inputs"]
+
+    return gp
+
+def _minimize_logpost(logpost, logpost_deriv, sample, n_params, n_tries=15, theta0=None,
+                      method='L-BFGS-B', **kwargs):
+    """Minimize a negative log-posterior from several starting points
+
+    Runs the minimization ``n_tries`` times, starting first from
+    ``theta0`` (if provided) and then from points drawn using
+    ``sample``, skipping any attempts that fail due to a linear
+    algebra or floating point error. Returns the best point found,
+    or ``None`` if all attempts failed. Accepts keyword arguments
+    passed to scipy's minimization routine.
+
+    """
+
     n_tries = int(n_tries)
     assert n_tries > 0, "number of attempts must be positive"
 
@@ -237,12 +299,12 @@ def _fit_single_GP_MAP(gp, n_tries=15, theta0=None, method='L-BFGS-B', **kwargs)
     for i in range(n_tries):
         if i == 0 and not theta0 is None:
             theta = np.array(theta0)
-            assert theta.shape == (gp.n_params,), "theta0 must be a 1D array with length n_params"
+            assert theta.shape == (n_params,), "theta0 must be a 1D array with length n_params"
         else:
-            theta = gp.priors.sample()
+            theta = sample()
         try:
-            min_dict = minimize(gp.logposterior, theta, method = method,
-                                jac = gp.logpost_deriv, options = kwargs)
+            min_dict = minimize(logpost, theta, method = method,
+                                jac = logpost_deriv, options = kwargs)
 
             min_theta = min_dict['x']
             min_logpost = min_dict['fun']
@@ -256,19 +318,87 @@ def _fit_single_GP_MAP(gp, n_tries=15, theta0=None, method='L-BFGS-B', **kwargs)
 
     if len(logpost_values) == 0:
         print("Minimization routine failed to return a value")
-        gp.theta = None
+        return None
+
+    logpost_values = np.array(logpost_values)
+    idx = np.argmin(logpost_values)
+
+    return theta_values[idx]
+
+def _fit_shared_MAP(emulators, n_tries=15, theta0=None, method='L-BFGS-B', **kwargs):
+    """Fit a single set of hyperparameters using MAP for several GPs
+
+    Fits all emulators with the same hyperparameters by minimizing
+    the sum of their negative log-likelihoods minus the log-prior of
+    the hyperparameters, which is taken from the first emulator and
+    only included once. All emulators must have
+    the same inputs, kernel, and nugget, so that the covariance matrix
+    only needs to be factorized once for each set of hyperparameters
+    and the factorization is reused by all emulators, as are the
+    derivatives of its log-determinant. Emulators are fit in place.
+    Accepts keyword arguments passed to scipy's minimization routine.
+
+    """
+
+    ref = emulators[0]
+
+    for em in emulators:
+        assert isinstance(em, GaussianProcess), "shared kernel fitting requires GaussianProcess emulators"
+        assert em.n_params == ref.n_params, "emulators must have the same number of parameters to share the kernel"
+        assert type(em.kernel) == type(ref.kernel), "emulators must use the same kernel to share the kernel"
+        assert em.nugget_type == ref.nugget_type, "emulators must use the same nugget to share the kernel"
+        if em.nugget_type == "fixed":
+            assert em.nugget == ref.nugget, "emulators must use the same nugget to share the kernel"
+        assert np.array_equal(em.inputs, ref.inputs), "emulators must have the same inputs to share the kernel"
+
+    release_sqdiff = ref._cache_sqdiff()
+
+    def fit_shared(theta):
+        if any(em._refit(theta) for em in emulators):
+            ref._fit_covariance(theta)
+            ref._fit_targets()
+            for em in emulators[1:]:
+                em._share_covariance(ref, theta)
+                em._fit_targets()
+
+    # the log-posterior of each emulator includes its prior, which is
+    # added back so that the prior of the shared values is counted once
+
+    def logpost(theta):
+        fit_shared(theta)
+        return (sum(em.current_logpost + em._priors.logp(em.theta) for em in emulators) -
+                ref._priors.logp(ref.theta))
+
+    def logpost_deriv(theta):
+        fit_shared(theta)
+        return (sum(em.logpost_deriv(theta) + em._priors.dlogpdtheta(em.theta) for em in emulators) -
+                ref._priors.dlogpdtheta(ref.theta))
+
+    theta = _minimize_logpost(logpost, logpost_deriv, ref.priors.sample, ref.n_params,
+                              n_tries, theta0, method, **kwargs)
+
+    if theta is None:
+        for em in emulators:
+            em.theta = None
     else:
-        logpost_values = np.array(logpost_values)
-        idx = np.argmin(logpost_values)
+        fit_shared(theta)
+        # the factor is shared by all emulators, so a later fit of the
+        # reference emulator must not overwrite it in place
+        ref._chol_buffer = None
 
-        gp.fit(theta_values[idx])
+    for em in emulators:
+        em._deriv_cache = {}
+    if release_sqdiff:
+        del ref._sqdiff_cache["inputs"]
 
-    return gp
+    return emulators
 
-def _fit_single_GP_MAP_bound(gp, theta0, n_tries, method, **kwargs):
-    "fitting function accepting theta0 as an argument for parallelization"
+def _fit_single_GP_MAP_worker(idx, n_tries, method, **kwargs):
+    """fitting function for pool workers, with the GP and starting point looked up
+    by index in the worker state so that only the index is sent for each task"""
 
-    return _fit_single_GP_MAP(gp, n_tries=n_tries, theta0=theta0, method=method, **kwargs)
+    return _fit_single_GP_MAP(_worker_state["emulators"][idx], n_tries=n_tries,
+                              theta0=_worker_state["theta0"][idx], method=method, **kwargs)
 
 def _fit_MOGP_MAP(gp, n_tries=15, theta0=None, method='L-BFGS-B',
                   refit=False, **kwargs):
@@ -287,6 +417,27 @@ def _fit_MOGP_MAP(gp, n_tries=15, theta0=None, method='L-BFGS-B',
     control the number of subprocesses used to fit the individual GPs
     in parallel. Must be positive. Default is ``None``.
 
+    Also accepts a ``backend`` keyword argument (``"thread"`` or
+    ``"process"``) to select whether the GPs are fit in a pool of
+    threads or of processes. Default is ``"process"``, as the
+    optimization routine runs in Python and holds the GIL for much of
+    the fit, so threads only give a speedup when the cost is dominated
+    by factorizing large covariance matrices. The process backend runs
+    in serial on Windows, while threads can be used on any platform.
+    Fitting is also done in serial if only one process is requested or,
+    if neither ``processes`` nor ``backend`` is given, if there are too
+    few emulators to fit for starting the workers to pay off.
+
+    Passing ``shared_kernel=True`` instead fits a single set of
+    hyperparameters for all of the emulators being fit, found by
+    minimizing the sum of the negative log-likelihoods minus a single
+    log-prior, taken from the first emulator being fit. This requires
+    that the emulators have the same kernel and nugget, and means the
+    covariance matrix only needs to be factorized once per set of
+    hyperparameters rather than once per emulator. In this case
+    ``theta0`` must be ``None`` or a single 1D array, and the fitting
+    is done in serial, so ``processes`` and ``backend`` have no effect.
+
     """
 
     assert isinstance(gp, MultiOutputGP)
@@ -297,9 +448,29 @@ def _fit_MOGP_MAP(gp, n_tries=15, theta0=None, method='L-BFGS-B',
     except KeyError:
         processes = None
 
+    try:
+        backend = kwargs['backend']
+        del kwargs['backend']
+    except KeyError:
+        backend = None
+
+    auto_parallel = processes is None and backend is None
+
+    backend = _get_backend(backend, "process")
+
+    try:
+        shared_kernel = bool(kwargs['shared_kernel'])
+        del kwargs['shared_kernel']
+    except KeyError:
+        shared_kernel = False
+
     n_tries = int(n_tries)
     assert n_tries > 0, "n_tries must be a positive integer"
 
+    if shared_kernel:
+        assert theta0 is None or np.array(theta0).ndim == 1, "theta0 must be a 1D array when sharing the kernel"
+        theta0 = None if theta0 is None else np.array(theta0)
+
     if theta0 is None:
         theta0 = [ None ]*gp.n_emulators
     else:
@@ -325,16 +496,42 @@ def _fit_MOGP_MAP(gp, n_tries=15, theta0=None, method='L-BFGS-B',
         emulators_to_fit = gp.get_emulators_not_fit()
         thetavals = [ theta0[idx] for idx in indices_to_fit]
 
-    if platform.system() == "Windows":
+    if len(emulators_to_fit) == 0:
+        return gp
+
+    # the emulators share the cache of squared input differences, which is
+    # filled here and held until all emulators are fit, so that they are
+    # computed once rather than by each emulator (or each thread)
+    sqdiff_cache = emulators_to_fit[0]._sqdiff_cache
+    release_sqdiff = emulators_to_fit[0]._cache_sqdiff()
 
-        fit_MOGP = [fit_GP_MAP(emulator, n_tries=n_tries, theta0=t0, method=method, **kwargs)
+    serial_fit = ((auto_parallel and len(emulators_to_fit) <= _SERIAL_FIT_MAX_EMULATORS) or
+                  processes == 1 or
+                  (backend == "process" and platform.system() == "Windows"))
+
+    if shared_kernel:
+        fit_MOGP = _fit_shared_MAP(emulators_to_fit, n_tries, thetavals[0], method, **kwargs)
+    elif serial_fit:
+        fit_MOGP = [_fit_single_GP_MAP(emulator, n_tries=n_tries, theta0=t0, method=method, **kwargs)
                     for (emulator, t0) in zip(emulators_to_fit, thetavals)]
+    elif backend == "thread":
+        with ThreadPoolExecutor(processes) as executor:
+            fit_MOGP = list(executor.map(lambda emulator, t0: _fit_single_GP_MAP(emulator, n_tries=n_tries,
+                                                                                 theta0=t0, method=method,
+                                                                                 **kwargs),
+                                         emulators_to_fit, thetavals))
     else:
-        with Pool(processes) as p:
-            fit_MOGP = p.starmap(partial(_fit_single_GP_MAP_bound, n_tries=n_tries, method=method, **kwargs),
-                                 [(emulator, t0) for (emulator, t0) in zip(emulators_to_fit, thetavals)])
+        with Pool(processes, initializer=_init_worker,
+                  initargs=({"emulators": emulators_to_fit, "theta0": thetavals},)) as p:
+            fit_MOGP = list(p.imap(partial(_fit_single_GP_MAP_worker, n_tries=n_tries, method=method, **kwargs),
+                                   range(len(emulators_to_fit)),
+                                   chunksize=_get_chunksize(len(emulators_to_fit), processes)))
+
+    if release_sqdiff:
+        del sqdiff_cache["inputs"]
 
     for (idx, em) in zip(indices_to_fit, fit_MOGP):
         gp.emulators[idx] = em
+        gp._link_emulator(idx)
 
     return gp
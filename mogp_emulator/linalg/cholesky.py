@@ -14,7 +14,7 @@ class ChoInv(object):
     """
 
     def __init__(self, L):
-        L = np.array(L)
+        L = np.asarray(L)
         assert L.ndim == 2, "L must be a 2D array"
         assert L.shape[0] == L.shape[1]
         self.L = L
@@ -78,6 +78,22 @@ class ChoInv(object):
         else:
             return 2.0 * np.sum(np.log(np.diag(self.L)))
 
+    def astype(self, dtype):
+        """Copy of the factorized matrix in another floating point type
+
+        Returns a new object holding the factorized matrix converted
+        to the given type. Solves with the new object are done by the
+        LAPACK routines for that type, so a single precision copy can
+        be used to speed up solves where full precision is not needed.
+
+        :param dtype: Floating point type for the factorized matrix
+        :type dtype: dtype
+        :returns: Factorized matrix in the requested type
+        :rtype: ChoInv
+        """
+
+        return ChoInv(self.L.astype(dtype))
+
 
 class ChoInvPivot(ChoInv):
     """
@@ -164,28 +180,50 @@ class ChoInvPivot(ChoInv):
             except (IndexError, ValueError):
                 raise ValueError("Bad values for pivot matrix in pivot_cho_solve")
 
+    def astype(self, dtype):
+        """Copy of the factorized matrix in another floating point type
+
+        Returns a new object holding the factorized matrix converted
+        to the given type, with the same pivoting order.
+
+        :param dtype: Floating point type for the factorized matrix
+        :type dtype: dtype
+        :returns: Factorized matrix in the requested type
+        :rtype: ChoInvPivot
+        """
+
+        return ChoInvPivot(self.L.astype(dtype), self.P)
+
 
-def cholesky_factor(A, nugget, nugget_type):
+def cholesky_factor(A, nugget, nugget_type, out=None):
     """
     Interface for Cholesky factorization
 
     Calls the appropriate method given how the nugget is handled and
     returns the factorized matrix as a ChoInv class along with the
-    nugget value
+    nugget value. The input matrix is not modified.
+
+    Optionally, a preallocated Fortran-ordered work array with the
+    same shape as ``A`` can be provided via ``out``, in which case the
+    factorization is done in place in that array rather than in newly
+    allocated memory (not used for the pivoting method). This
+    allows the same memory to be reused when factorizing many
+    matrices of the same size, such as when fitting hyperparameters.
     """
 
     if isinstance(nugget, float):
         assert nugget >= 0.0, "Nugget must be non-negative in cholesky_factor"
 
     if nugget_type == "adaptive":
-        L, nugget = jit_cholesky(A)
+        L, nugget = jit_cholesky(A, out=out)
         Ainv = ChoInv(L)
     elif nugget_type == "pivot":
         L, P = pivot_cholesky(A)
         Ainv = ChoInvPivot(L, P)
     elif nugget_type in ["fit", "fixed"]:
-        A += nugget * np.eye(A.shape[0])
-        L = fixed_cholesky(A)
+        A = _copy_to_work(A, out)
+        A[np.diag_indices_from(A)] += nugget
+        L = fixed_cholesky(A, overwrite_a=True)
         Ainv = ChoInv(L)
     else:
         raise ValueError("Bad value for nugget_type in cholesky_factor")
@@ -210,7 +248,7 @@ def _check_cholesky_inputs(A):
     :rtype: ndarray
     """
 
-    A = np.array(A)
+    A = np.asarray(A)
     assert A.ndim == 2, "A must have shape (n,n)"
     assert A.shape[0] == A.shape[1], "A must have shape (n,n)"
     np.testing.assert_allclose(A.T, A)
@@ -222,16 +260,69 @@ def _check_cholesky_inputs(A):
     return A
 
 
-def fixed_cholesky(A):
+def _copy_to_work(A, out=None):
+    """
+    Copy a matrix into a Fortran-ordered work array
+
+    Copies ``A`` into the provided work array ``out`` (or into a newly
+    allocated one if ``out`` is ``None``), so that it can be
+    factorized in place by LAPACK without an additional internal
+    copy. Returns the work array.
+    """
+
+    if out is None:
+        out = np.empty(A.shape, order="F")
+    else:
+        assert out.shape == A.shape, "work array must have the same shape as the matrix"
+        assert out.flags.f_contiguous, "work array must be Fortran ordered"
+
+    np.copyto(out, A)
+
+    return out
+
+
+def _potrf(A, overwrite_a=False):
+    """
+    Factorize a matrix by calling LAPACK directly
+
+    Computes the lower triangular Cholesky factor of ``A`` using the
+    LAPACK ``potrf`` routine, bypassing the additional input checks
+    done by ``scipy.linalg.cholesky`` (the inputs have already been
+    checked by ``_check_cholesky_inputs``). Returns the factor and a
+    boolean indicating if the factorization succeeded. A NaN on the
+    diagonal of the factor is treated as a failure, as ``potrf`` does
+    not check for non-finite values.
+
+    If ``overwrite_a`` is ``True`` and ``A`` is Fortran ordered, the
+    factorization is done in place and ``A`` holds the factor on exit.
+    """
+
+    potrf, = lapack.get_lapack_funcs(("potrf",), (A,))
+
+    L, info = potrf(A, lower=1, overwrite_a=int(overwrite_a))
+
+    return L, (info == 0 and np.all(np.isfinite(np.diag(L))))
+
+
+def fixed_cholesky(A, overwrite_a=False):
     """
     Cholesky decomposition with fixed noise level
+
+    If ``overwrite_a`` is ``True`` and ``A`` is a Fortran ordered
+    array, the factorization is done in place and ``A`` is
+    overwritten with the factor.
     """
     A = _check_cholesky_inputs(A)
 
-    return linalg.cholesky(A, lower=True)
+    L, success = _potrf(A, overwrite_a)
+
+    if not success:
+        raise linalg.LinAlgError("not positive definite")
 
+    return L
 
-def jit_cholesky(A, maxtries=5):
+
+def jit_cholesky(A, maxtries=5, out=None):
     """
     Performs Jittered Cholesky Decomposition
 
@@ -252,6 +343,11 @@ def jit_cholesky(A, maxtries=5):
     :param maxtries: (optional) Maximum allowable number of attempts to stabilize the Cholesky
                      Decomposition. Must be a positive integer (default = 5)
     :type maxtries: int
+    :param out: (optional) Preallocated Fortran-ordered work array with the same shape as
+                ``A``, used to compute the factorization in place. The same memory is reused
+                for each attempt. If ``None`` (default), a new array is allocated. ``A``
+                itself is never modified.
+    :type out: ndarray or None
     :returns: Lower-triangular factored matrix (shape ``(n,n)`` and the noise that was added to
               the diagonal to achieve that result.
     :rtype: tuple containing an ndarray and a float
@@ -260,26 +356,24 @@ def jit_cholesky(A, maxtries=5):
     A = _check_cholesky_inputs(A)
     assert int(maxtries) > 0, "maxtries must be a positive integer"
 
-    A = np.ascontiguousarray(A)
-    L, info = lapack.dpotrf(A, lower=1)
-    if info == 0:
+    work = _copy_to_work(A, out)
+    L, success = _potrf(work, overwrite_a=True)
+    if success:
         return L, 0.0
     else:
-        diagA = np.diag(A)
-        jitter = diagA.mean() * 1e-6
+        diag_idx = np.diag_indices_from(A)
+        jitter = np.diag(A).mean() * 1e-6
         num_tries = 1
         while num_tries <= maxtries and np.isfinite(jitter):
-            try:
-                L = linalg.cholesky(A + np.eye(A.shape[0]) * jitter, lower=True)
+            np.copyto(work, A)
+            work[diag_idx] += jitter
+            L, success = _potrf(work, overwrite_a=True)
+            if success:
                 return L, jitter
-            except:
-                jitter *= 10
-            finally:
-                num_tries += 1
+            jitter *= 10
+            num_tries += 1
         raise linalg.LinAlgError("not positive definite, even with jitter.")
 
-    return L, jitter
-
 
 def pivot_cholesky(A):
     """
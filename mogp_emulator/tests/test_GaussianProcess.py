@@ -548,6 +548,67 @@ def test_GaussianProcess_fit_logposterior(x, y, mean, nugget, sn):
     assert_allclose(logpost_expect, gp.current_logpost)
     assert_allclose(logpost_expect, gp.logposterior(theta))
 
+def test_GaussianProcess_fit_buffers(x, y):
+    "test that the factorization work array is reused when refitting"
+
+    gp = GaussianProcess(x, y, nugget=0., priors=GPPriors(n_corr=3, nugget_type="fixed"))
+
+    gp.fit(np.ones(gp.n_params))
+
+    buffer = gp._get_chol_buffer()
+    assert np.shares_memory(gp.Kinv.L, buffer)
+
+    # the covariance matrix is not held after fitting
+
+    assert not "K" in gp._deriv_cache
+    gp.logpost_deriv(np.ones(gp.n_params))
+    assert_allclose(gp._deriv_cache["K"], gp.get_K_matrix())
+
+    gp.fit(np.zeros(gp.n_params))
+
+    assert gp._get_chol_buffer() is buffer
+    assert np.shares_memory(gp.Kinv.L, buffer)
+    assert_allclose(gp.Kinv.L, np.linalg.cholesky(gp.get_K_matrix()))
+
+    assert gp._deriv_cache == {}
+
+    gp.theta = None
+
+@pytest.mark.parametrize("nugget", [0., "adaptive", "fit"])
+def test_GaussianProcess_share_covariance(x, y, nugget):
+    "test that an emulator using a shared covariance matches one that is fit directly"
+
+    nugget_type = "fixed" if isinstance(nugget, float) else nugget
+
+    ref = GaussianProcess(x, y, nugget=nugget, priors=GPPriors(n_corr=3, nugget_type=nugget_type))
+    gp = GaussianProcess(x, 2.*y + 1., mean="1", nugget=nugget,
+                         priors=GPPriors(n_corr=3, nugget_type=nugget_type))
+    gp_expect = GaussianProcess(x, 2.*y + 1., mean="1", nugget=nugget,
+                                priors=GPPriors(n_corr=3, nugget_type=nugget_type))
+
+    theta = np.ones(gp.n_params)
+
+    ref._fit_covariance(theta)
+    ref._fit_targets()
+    ref.logpost_deriv(theta)
+    gp._share_covariance(ref, theta)
+    gp._fit_targets()
+    gp_expect.fit(theta)
+
+    assert gp.Kinv is ref.Kinv
+    assert gp._deriv_cache is ref._deriv_cache
+    assert_allclose(gp.theta.get_data(), gp_expect.theta.get_data())
+    assert_allclose(gp.nugget, gp_expect.nugget)
+    assert_allclose(gp.Kinv_t, gp_expect.Kinv_t)
+    assert_allclose(gp.current_logpost, gp_expect.current_logpost)
+    assert_allclose(gp.logpost_deriv(theta), gp_expect.logpost_deriv(theta))
+
+    # refitting clears the shared derivatives
+
+    gp.fit(np.zeros(gp.n_params))
+    assert not gp._deriv_cache is ref._deriv_cache
+    assert len(ref._deriv_cache) > 0
+
 def test_GaussianProcess_logposterior(x, y):
     "test logposterior method of GaussianProcess"
 
@@ -844,6 +905,67 @@ def test_GaussianProcess_priors(x, y, dx, priors, nugget, sn):
     #
     # assert_allclose(hess, gp.logpost_hessian(theta), rtol=1.e-5, atol=1.e-5)
 
+def test_GaussianProcess_predict_cache(x, y):
+    "test that repeated predictions are cached until the emulator is refit"
+
+    gp = GaussianProcess(x, y, nugget=0.)
+    gp.fit(np.ones(gp.n_params))
+
+    x_test = np.array([[2., 3., 4.], [1., 2., 2.]])
+
+    # predictions are only cached if requested
+
+    assert not gp.cache_predictions
+    gp.predict(x_test)
+    assert gp._predict_cache == []
+
+    gp.cache_predictions = True
+
+    mu, var, _ = gp.predict(x_test)
+    assert len(gp._predict_cache) == 1
+
+    # cached results are returned as copies
+
+    mu[0] = 1.e6
+    mu_cached, var_cached, _ = gp.predict(x_test)
+    assert len(gp._predict_cache) == 1
+    assert_allclose(mu_cached, gp.predict(x_test, unc=False)[0])
+    assert not mu_cached[0] == 1.e6
+
+    # modifying the prediction points in place is not a cache hit
+
+    x_test[0, 0] = 3.
+    mu_new, _, _ = gp.predict(x_test)
+    gp_nocache = GaussianProcess(x, y, nugget=0.)
+    gp_nocache.fit(np.ones(gp.n_params))
+    assert_allclose(mu_new, gp_nocache.predict(x_test)[0])
+
+    # number of cached entries is bounded, and full covariances are not cached
+
+    gp.predict(x_test, unc=False)
+    assert len(gp._predict_cache) == 2
+    gp.predict(x_test, full_cov=True)
+    assert len(gp._predict_cache) == 2
+    assert not any([key[2] for (key, _, _, _) in gp._predict_cache])
+
+    # refitting clears the cache
+
+    gp.fit(np.zeros(gp.n_params))
+    assert gp._predict_cache == []
+    gp_nocache.fit(np.zeros(gp.n_params))
+    assert_allclose(gp.predict(x_test)[1], gp_nocache.predict(x_test)[1])
+
+    gp.theta = None
+    assert gp._predict_cache == []
+
+    # turning off caching clears the cache
+
+    gp.fit(np.zeros(gp.n_params))
+    gp.predict(x_test)
+    assert len(gp._predict_cache) == 1
+    gp.cache_predictions = False
+    assert gp._predict_cache == []
+
 def test_GaussianProcess_predict(x, y):
     "test the predict method of GaussianProcess"
 
@@ -1141,6 +1263,20 @@ def test_GaussianProcess_predict_pivot():
     assert_allclose(mean1, mean2)
     assert_allclose(var1, var2)
 
+    # same with a mean function and the full covariance
+
+    gp1 = GaussianProcess(x1, y1, mean="x[0]", nugget=0.)
+    gp2 = GaussianProcess(x2, y2, mean="x[0]", nugget="pivot")
+
+    gp1.theta = np.zeros(2)
+    gp2.theta = np.zeros(2)
+
+    mean1, var1, deriv1 = gp1.predict(xpred, full_cov=True)
+    mean2, var2, deriv2 = gp2.predict(xpred, full_cov=True)
+
+    assert_allclose(mean1, mean2)
+    assert_allclose(var1, var2, atol=1.e-10)
+
 def test_GaussianProcess_predict_variance():
     "confirm that caching factorized matrix produces stable variance predictions"
 
@@ -4,6 +4,8 @@ from numpy.testing import assert_allclose
 from ..Kernel import StationaryKernel, UniformKernel, ProductKernel
 from ..Kernel import SqExpBase, Mat52Base
 from ..Kernel import SquaredExponential, Matern52, UniformSqExp, UniformMat52, ProductMat52
+from ..Kernel import _calc_scaled_r2
+from .. import Kernel
 
 def test_stationary_calc_r2():
     "test function for calc_r2 function for stationary kernels"
@@ -37,6 +39,68 @@ def test_stationary_calc_r2():
 
     assert_allclose(k.calc_r2(x, y, params), np.array([[1., 4.], [0., 1.]]))
 
+def test_calc_sqdiff():
+    "test function for calc_sqdiff and passing precomputed squared differences"
+
+    x = np.array([[1., 2.], [2., 3.]])
+    y = np.array([[2., 4.], [3., 1.], [0., 0.]])
+
+    k = StationaryKernel()
+
+    sqdiff = k.calc_sqdiff(x, y)
+
+    assert sqdiff.shape == (2, 2, 3)
+    assert sqdiff[0].flags["C_CONTIGUOUS"]
+    assert_allclose(sqdiff[:, 0, 1], np.array([4., 1.]))
+    assert_allclose(sqdiff[:, 1, 2], np.array([4., 9.]))
+
+    # same points for both inputs
+
+    sqdiff_expect = (y.T[:, :, np.newaxis] - y.T[:, np.newaxis, :])**2
+
+    for y2 in [y, np.copy(y)]:
+        sqdiff_sym = k.calc_sqdiff(y, y2)
+
+        assert sqdiff_sym.shape == (2, 3, 3)
+        assert sqdiff_sym[0].flags["C_CONTIGUOUS"]
+        assert_allclose(sqdiff_sym, sqdiff_expect)
+
+    params = np.array([np.log(2.), np.log(4.)])
+
+    for k in [SquaredExponential(), Matern52(), ProductMat52()]:
+        assert_allclose(k.kernel_f(x, y, params, sqdiff=sqdiff), k.kernel_f(x, y, params))
+        assert_allclose(k.kernel_deriv(x, y, params, sqdiff=sqdiff),
+                        k.kernel_deriv(x, y, params))
+
+    params = np.array([np.log(2.)])
+
+    for k in [UniformSqExp(), UniformMat52()]:
+        assert_allclose(k.kernel_f(x, y, params, sqdiff=sqdiff), k.kernel_f(x, y, params))
+        assert_allclose(k.kernel_deriv(x, y, params, sqdiff=sqdiff),
+                        k.kernel_deriv(x, y, params))
+
+    with pytest.raises(AssertionError):
+        k.kernel_f(x, y, params, sqdiff=sqdiff[:, :, :2])
+
+    with pytest.raises(AssertionError):
+        k.calc_sqdiff(np.ones(3), y)
+
+@pytest.mark.parametrize("use_numba", [True, False])
+def test_calc_scaled_r2(monkeypatch, use_numba):
+    "test the weighted squared distance computation with and without numba"
+
+    if use_numba and not Kernel.numba_available:
+        pytest.skip("numba is not installed")
+
+    monkeypatch.setattr(Kernel, "numba_available", use_numba)
+
+    x = np.array([[1., 2.], [2., 3.]])
+    y = np.array([[2., 4.], [3., 1.], [0., 0.]])
+    weights = np.array([2., 4.])
+
+    assert_allclose(_calc_scaled_r2(x, y, weights),
+                    np.sum(weights*(x[:, np.newaxis, :] - y[np.newaxis, :, :])**2, axis=-1))
+
 def test_stationary_calc_r_failures():
     "test scenarios where calc_r should raise an exception"
 
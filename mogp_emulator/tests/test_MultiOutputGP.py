@@ -1,15 +1,20 @@
 import numpy as np
+import pickle
+import weakref
+import sys
 import pytest
 from numpy.testing import assert_allclose
 from ..GaussianProcess import GaussianProcess, PredictResult
-from ..MultiOutputGP import MultiOutputGP
+from ..MultiOutputGP import MultiOutputGP, _get_chunksize
 from ..MultiOutputGP_GPU import MultiOutputGP_GPU
 from ..LibGPGPU import gpu_usable
 from ..MeanFunction import ConstantMean, LinearMean, MeanFunction
-from ..Kernel import Matern52, SquaredExponential
+from ..Kernel import KernelBase, Matern52, SquaredExponential
 from ..Priors import GPPriors
 from scipy import linalg
 
+MultiOutputGP_module = sys.modules[MultiOutputGP.__module__]
+
 GPU_NOT_FOUND_MSG = "A compatible GPU could not be found or the GPU library (libgpgpu) could not be loaded"
 
 @pytest.fixture
@@ -45,6 +50,83 @@ def test_MultiOutputGP_init(x, y):
     gp = MultiOutputGP(x, y, nugget=[0., "adaptive"])
 
 
+def test_MultiOutputGP_sqdiff(x, y):
+    "test that the squared differences of the inputs are shared by all emulators"
+
+    gp = MultiOutputGP(x, y, kernel=["SquaredExponential", "Matern52"])
+
+    # squared differences are only held in the cache while fitting
+
+    assert not gp.emulators[0]._get_sqdiff() is gp.emulators[1]._get_sqdiff()
+
+    assert gp.emulators[0]._cache_sqdiff()
+    assert not gp.emulators[1]._cache_sqdiff()
+
+    sqdiff = gp.emulators[0]._get_sqdiff()
+
+    assert sqdiff is gp.emulators[1]._get_sqdiff()
+    assert_allclose(sqdiff, np.transpose((x[:, np.newaxis, :] - x[np.newaxis, :, :])**2, (2, 0, 1)))
+
+
+def test_MultiOutputGP_targets(x, y):
+    "test that the emulator targets are views of the shared targets array"
+
+    gp = MultiOutputGP(x, y)
+
+    assert gp.targets.flags["C_CONTIGUOUS"]
+    assert not gp.targets.flags["WRITEABLE"]
+    assert_allclose(gp.targets, y)
+
+    for (idx, em) in enumerate(gp.emulators):
+        assert np.shares_memory(em.targets, gp.targets)
+        assert_allclose(em.targets, y[idx])
+        assert em.inputs is gp.inputs
+
+    # inputs that are already conforming arrays are not copied when predicting
+
+    x_test = np.array([[2., 3., 4.]])
+    assert gp._process_inputs(x_test) is x_test
+    assert gp._process_inputs([[2, 3, 4]]).dtype == np.float64
+
+    # replacing an emulator with a copy and relinking restores the view
+
+    gp.emulators[0] = pickle.loads(pickle.dumps(gp.emulators[0]))
+    assert not np.shares_memory(gp.emulators[0].targets, gp.targets)
+
+    gp._link_emulator(0)
+    assert np.shares_memory(gp.emulators[0].targets, gp.targets)
+    assert gp.emulators[0].inputs is gp.inputs
+    assert gp.emulators[0]._sqdiff_cache is gp.emulators[1]._sqdiff_cache
+
+def test_MultiOutputGP_pickle(x, y):
+    "test that the emulators share the inputs, targets and squared differences after pickling"
+
+    gp = MultiOutputGP(x, y, nugget=0.)
+    gp.fit([np.ones(n) for n in gp.n_params])
+    gp.emulators[0]._cache_sqdiff()
+
+    assert len(gp._sqdiff_cache) > 0
+
+    gp_new = pickle.loads(pickle.dumps(gp))
+
+    assert gp_new._sqdiff_cache == {}
+    assert not gp_new.targets.flags["WRITEABLE"]
+    assert not gp_new.inputs.flags["WRITEABLE"]
+
+    for (idx, em) in enumerate(gp_new.emulators):
+        assert em.inputs is gp_new.inputs
+        assert np.shares_memory(em.targets, gp_new.targets)
+        assert em._sqdiff_cache is gp_new._sqdiff_cache
+
+    gp_new.emulators[0]._cache_sqdiff()
+    assert gp_new.emulators[1]._sqdiff_cache is gp_new._sqdiff_cache
+    assert len(gp_new._sqdiff_cache) > 0
+
+    x_test = np.array([[2., 3., 4.]])
+    gp_new.fit([np.ones(n) for n in gp.n_params])
+    assert_allclose(gp_new.predict(x_test).mean, gp.predict(x_test).mean)
+
+
 @pytest.mark.skipif(not gpu_usable(), reason=GPU_NOT_FOUND_MSG)
 def test_MultiOutputGP_GPU_init(x, y):
     "Test function for correct functioning of the init method of GaussianProcessGPU"
@@ -58,7 +140,7 @@ def test_MultiOutputGP_GPU_init(x, y):
 def dx():
     return 1.e-6
 
-def test_MultiOutputGP_predict(x, y, dx):
+def test_MultiOutputGP_predict(x, y, dx, monkeypatch):
     "test the predict method of GaussianProcess"
 
     gp = MultiOutputGP(x, y, nugget=0.)
@@ -70,6 +152,48 @@ def test_MultiOutputGP_predict(x, y, dx):
 
     mu, var, deriv = gp.predict(x_test)
 
+    # check parallel predictions match the serial ones
+
+    with monkeypatch.context() as m:
+        m.setattr(MultiOutputGP_module, "_SERIAL_PREDICT_MAX_EMULATORS", 0)
+
+        for backend in ["thread", "process"]:
+            mu_backend, var_backend, _ = gp.predict(x_test, backend=backend)
+            assert_allclose(mu_backend, mu)
+            assert_allclose(var_backend, var)
+
+    with pytest.raises(AssertionError):
+        gp.predict(x_test, backend="bad")
+
+    # a single process always predicts in serial
+
+    def pool_fail(*args, **kwargs):
+        raise AssertionError("pool should not be used")
+
+    with monkeypatch.context() as m:
+        m.setattr(MultiOutputGP_module, "_SERIAL_PREDICT_MAX_EMULATORS", 0)
+        m.setattr(MultiOutputGP_module, "Pool", pool_fail)
+        m.setattr(MultiOutputGP_module, "ThreadPoolExecutor", pool_fail)
+
+        mu_serial, var_serial, _ = gp.predict(x_test, processes=1)
+        assert_allclose(mu_serial, mu)
+        assert_allclose(var_serial, var)
+
+    # a few emulators are predicted in serial unless the pool is requested
+
+    with monkeypatch.context() as m:
+        m.setattr(MultiOutputGP_module, "Pool", pool_fail)
+        m.setattr(MultiOutputGP_module, "ThreadPoolExecutor", pool_fail)
+
+        mu_serial, var_serial, _ = gp.predict(x_test)
+        assert_allclose(mu_serial, mu)
+
+        with pytest.raises(AssertionError):
+            gp.predict(x_test, processes=2)
+
+        with pytest.raises(AssertionError):
+            gp.predict(x_test, backend="thread")
+
     for i in range(2):
 
         K = np.exp(thetas[i][-1])*gp.emulators[i].kernel.kernel_f(x, x, thetas[i][:-1])
@@ -123,6 +247,20 @@ def test_MultiOutputGP_predict(x, y, dx):
     assert np.all(np.isnan(mu[1]))
     assert np.all(np.isnan(var[1]))
 
+    mu, var, deriv = gp.predict(x_test, allow_not_fit=True, full_cov=True)
+    assert var.shape == (2, 1, 1)
+    assert not np.any(np.isnan(var[0]))
+    assert np.all(np.isnan(var[1]))
+
+    with monkeypatch.context() as m:
+        m.setattr(MultiOutputGP_module, "_SERIAL_PREDICT_MAX_EMULATORS", 0)
+
+        for backend in ["thread", "process"]:
+            mu, var, deriv = gp.predict(x_test, allow_not_fit=True, backend=backend)
+            assert not np.any(np.isnan(mu[0]))
+            assert np.all(np.isnan(mu[1]))
+            assert np.all(np.isnan(var[1]))
+
     mu, var, deriv = gp.predict(x_test, unc=False, deriv=False,
                                 allow_not_fit=True)
     assert np.all(np.isnan(mu[1]))
@@ -133,6 +271,101 @@ def test_MultiOutputGP_predict(x, y, dx):
         gp.predict(x_test)
 
 
+def test_MultiOutputGP_predict_serial(x, y, monkeypatch):
+    "test that serial predictions sharing kernel evaluations match the single GP predictions"
+
+    gp = MultiOutputGP(np.tile(x, (4, 1)) + np.arange(24.).reshape(-1, 3),
+                       np.tile(y, (2, 4)), kernel=["SquaredExponential", "SquaredExponential",
+                                                   "SquaredExponential", "Matern52"])
+    thetas = np.zeros((4, gp.emulators[0].n_params))
+    thetas[2] = 0.5
+    gp.fit(thetas)
+
+    x_test = np.array([[2., 3., 4.], [1., 0., 3.]])
+
+    for full_cov in [False, True]:
+        for max_sqdiff in [0, 2**24]:
+            with monkeypatch.context() as m:
+                m.setattr(MultiOutputGP_module, "_SERIAL_PREDICT_MAX_SQDIFF", max_sqdiff)
+                mu, var, _ = gp.predict(x_test, full_cov=full_cov)
+
+            for i in range(4):
+                mu_expect, var_expect, _ = gp.emulators[i].predict(x_test, full_cov=full_cov)
+                assert_allclose(mu[i], mu_expect)
+                assert_allclose(var[i], var_expect)
+
+    # each shared correlation matrix is computed once and released before the next
+
+    corr_refs = []
+    kernel_f = KernelBase.kernel_f
+
+    def kernel_f_record(self, x1, x2, params, sqdiff=None):
+        assert all([ref() is None for ref in corr_refs])
+        corr = kernel_f(self, x1, x2, params, sqdiff)
+        corr_refs.append(weakref.ref(corr))
+        return corr
+
+    with monkeypatch.context() as m:
+        m.setattr(KernelBase, "kernel_f", kernel_f_record)
+        for idx, _ in gp._predict_serial(x_test, GaussianProcess.predict, True, False, True, False):
+            pass
+
+    assert len(corr_refs) == 3
+
+    # serial predictions use the emulator caches if turned on
+
+    assert not gp.cache_predictions
+    gp.cache_predictions = True
+    assert all([em.cache_predictions for em in gp.emulators])
+
+    cache_lookups = []
+    get_cached_predict = GaussianProcess._get_cached_predict
+
+    def get_cached_predict_record(self, *args):
+        cache_lookups.append(self)
+        return get_cached_predict(self, *args)
+
+    with monkeypatch.context() as m:
+        m.setattr(GaussianProcess, "_get_cached_predict", get_cached_predict_record)
+        mu, var, _ = gp.predict(x_test)
+
+    assert all([len(em._predict_cache) == 1 for em in gp.emulators])
+    assert len(cache_lookups) == gp.n_emulators
+    mu_cached, var_cached, _ = gp.predict(x_test)
+    assert_allclose(mu_cached, mu)
+    assert_allclose(var_cached, var)
+
+
+def test_MultiOutputGP_predict_dtype(x, y):
+    "test that predictions can be made in single precision"
+
+    gp = MultiOutputGP(x, y, nugget=0.)
+    gp_32 = MultiOutputGP(x, y, nugget=0., dtype=np.float32)
+    thetas = [np.ones((n,)) for n in gp.n_params]
+
+    gp.fit(thetas)
+    gp_32.fit(thetas)
+
+    x_test = np.array([[2., 3., 4.], [1., 2., 2.]])
+
+    for full_cov in [False, True]:
+        mu, var, _ = gp.predict(x_test, full_cov=full_cov)
+        mu_32, var_32, _ = gp_32.predict(x_test, full_cov=full_cov)
+
+        assert mu.dtype == np.float64
+        assert mu_32.dtype == np.float32
+        assert var_32.dtype == np.float32
+        assert_allclose(mu_32, mu, rtol=1.e-5, atol=1.e-5)
+        assert_allclose(var_32, var, rtol=1.e-5, atol=1.e-5)
+
+    # fitting is done in double precision
+
+    assert gp_32.emulators[0].Kinv.L.dtype == np.float64
+
+    with pytest.raises(AssertionError):
+        MultiOutputGP(x, y, dtype=np.int32)
+
+
 @pytest.mark.skipif(not gpu_usable(), reason=GPU_NOT_FOUND_MSG)
 def test_MultiOutputGP_GPU_predict(x, y, dx):
     "test the predict method of GaussianProcess"
@@ -240,3 +473,12 @@ def test_MultiOutputGP_GPU_check(x, y):
     gp.fit_emulator(1,theta) 
     assert gp.get_indices_fit() == [0, 1]
     assert gp.get_indices_not_fit() == []
+
+
+def test_get_chunksize():
+    "test the function that determines the chunk size for pool dispatch"
+
+    assert _get_chunksize(1, 4) == 1
+    assert _get_chunksize(16, 4) == 1
+    assert _get_chunksize(100, 4) == 6
+    assert _get_chunksize(100, None) >= 1
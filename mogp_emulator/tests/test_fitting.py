@@ -5,6 +5,7 @@ from ..GaussianProcess import GaussianProcess
 from ..GaussianProcessGPU import GaussianProcessGPU
 from ..LibGPGPU import gpu_usable
 from ..MultiOutputGP import MultiOutputGP
+from ..Kernel import KernelBase
 from ..fitting import fit_GP_MAP, _fit_single_GP_MAP, _fit_MOGP_MAP
 
 GPU_NOT_FOUND_MSG = "A compatible GPU could not be found or the GPU library (libgpgpu) could not be loaded"
@@ -135,7 +136,7 @@ def test_fit_GP_MAP_GPU_failures():
     with pytest.raises(RuntimeError):
         fit_GP_MAP(gp, theta0=np.ones(1))
 
-def test_fit_GP_MAP_MOGP():
+def test_fit_GP_MAP_MOGP(monkeypatch):
     "test the fit_GP_MAP function with multiple outputs"
 
     x = np.linspace(0., 1.)
@@ -163,6 +164,68 @@ def test_fit_GP_MAP_MOGP():
     gp = fit_GP_MAP(x, y, mean="0", nugget="fit", method="L-BFGS-B", processes=1)
     assert isinstance(gp, MultiOutputGP)
 
+    # thread and process backends give the same fit
+
+    with monkeypatch.context() as m:
+        m.setattr("mogp_emulator.fitting._SERIAL_FIT_MAX_EMULATORS", 0)
+        gp_thread = fit_GP_MAP(x, y, nugget="fit", theta0=np.zeros(3), n_tries=1, backend="thread")
+        gp_process = fit_GP_MAP(x, y, nugget="fit", theta0=np.zeros(3), n_tries=1, backend="process")
+
+    for (em_thread, em_process) in zip(gp_thread.emulators, gp_process.emulators):
+        assert_allclose(em_thread.theta.get_data(), em_process.theta.get_data())
+
+    # threads share a single copy of the squared input differences
+
+    sqdiff_calls = []
+    calc_sqdiff = KernelBase.calc_sqdiff
+
+    def calc_sqdiff_record(self, x1, x2):
+        sqdiff_calls.append(x1.shape)
+        return calc_sqdiff(self, x1, x2)
+
+    with monkeypatch.context() as m:
+        m.setattr("mogp_emulator.fitting._SERIAL_FIT_MAX_EMULATORS", 0)
+        m.setattr(KernelBase, "calc_sqdiff", calc_sqdiff_record)
+        fit_GP_MAP(MultiOutputGP(x, y, nugget="fit"), theta0=np.zeros(3), n_tries=1,
+                   backend="thread", processes=2)
+
+    assert len(sqdiff_calls) == 1
+
+    # the squared differences are released once fitting is done
+
+    gp = fit_GP_MAP(MultiOutputGP(x, y, nugget="fit"), theta0=np.zeros(3), n_tries=1)
+    assert gp._sqdiff_cache == {}
+    for em in gp.emulators:
+        assert em._sqdiff_cache is gp._sqdiff_cache
+
+    gp = fit_GP_MAP(MultiOutputGP(x, y, nugget="fit"), theta0=np.zeros(3), n_tries=1,
+                    shared_kernel=True)
+    assert gp._sqdiff_cache == {}
+
+    with pytest.raises(AssertionError):
+        fit_GP_MAP(MultiOutputGP(x, y, nugget="fit"), backend="bad")
+
+    # no pool is started for a single process or only a few emulators
+
+    def pool_fail(*args, **kwargs):
+        raise AssertionError("pool should not be used")
+
+    with monkeypatch.context() as m:
+        m.setattr("mogp_emulator.fitting.Pool", pool_fail)
+        m.setattr("mogp_emulator.fitting.ThreadPoolExecutor", pool_fail)
+        gp_serial = fit_GP_MAP(x, y, nugget="fit", theta0=np.zeros(3), n_tries=1)
+        for (em_serial, em_process) in zip(gp_serial.emulators, gp_process.emulators):
+            assert_allclose(em_serial.theta.get_data(), em_process.theta.get_data())
+        fit_GP_MAP(np.linspace(0., 1.), np.tile(y, (2, 1)), nugget="fit", theta0=np.zeros(3),
+                   n_tries=1, processes=1)
+
+        # an explicit number of processes or backend always uses the pool
+
+        for pool_kwargs in [{"processes": 2}, {"backend": "thread"}]:
+            with pytest.raises(AssertionError):
+                fit_GP_MAP(MultiOutputGP(x, y, nugget="fit"), theta0=np.zeros(3), n_tries=1,
+                           **pool_kwargs)
+
     # pass various theta0 arguments
 
     gp = fit_GP_MAP(x, y, nugget="fit", theta0=np.zeros(3))
@@ -266,6 +329,47 @@ def test_fit_single_GP_MAP(monkeypatch):
     assert_allclose(gp.theta.get_data(), theta_exp)
     assert_allclose(gp.current_logpost, logpost_exp)
 
+def test_fit_single_GP_MAP_no_refit(monkeypatch):
+    "test that the GP is only refit at the end of minimization if needed"
+
+    x = np.linspace(0., 1.)
+    y = x**2
+
+    fit_thetas = []
+    gp_fit = GaussianProcess.fit
+
+    def fit_record(self, theta):
+        fit_thetas.append(np.copy(theta))
+        gp_fit(self, theta)
+
+    monkeypatch.setattr(GaussianProcess, "fit", fit_record)
+
+    gp = GaussianProcess(x, y, nugget="fit")
+
+    gp = _fit_single_GP_MAP(gp, n_tries=1, theta0=np.zeros(3))
+
+    assert_allclose(gp.theta.get_data(), fit_thetas[-1])
+    assert len(fit_thetas) == 1 or not np.array_equal(fit_thetas[-1], fit_thetas[-2])
+
+    gp_check = GaussianProcess(x, y, nugget="fit")
+    assert_allclose(gp.current_logpost, gp_check.logposterior(gp.theta.get_data()))
+
+    # fitting again from a different point must leave the GP at the best value found
+
+    monkeypatch.setattr("mogp_emulator.fitting.minimize", minimize_mock)
+
+    gp = _fit_single_GP_MAP(gp, n_tries=1)
+
+    assert_allclose(gp.theta.get_data(), np.array([1.6, -2.1, -0.8]))
+    assert_allclose(gp.current_logpost, gp_check.logposterior(np.array([1.6, -2.1, -0.8])))
+
+    # cached values used in fitting are released after fitting, and recomputed if needed
+
+    assert gp._deriv_cache == {}
+    assert gp._sqdiff_cache == {}
+    assert_allclose(gp.logpost_deriv(gp.theta.get_data()),
+                    gp_check.logpost_deriv(gp.theta.get_data()))
+
 def test_fit_single_GP_MAP_failures():
     "test situation where fitting one emulator should fail"
 
@@ -341,6 +445,126 @@ def test_fit_MOGP_MAP():
     gp = _fit_MOGP_MAP(gp, theta0=np.zeros(3), n_tries=1, refit=True)
     assert not np.allclose(gp.emulators[0].theta.get_data(), np.ones(3))
 
+def test_fit_MOGP_MAP_shared_kernel(monkeypatch):
+    "test fitting a MOGP with the same hyperparameters for all emulators"
+
+    x = np.linspace(0., 1.)
+    y = np.zeros((3, 50))
+    y[0] = x**2
+    y[1] = 2. + x**3
+    y[2] = np.sin(x)
+
+    gp = MultiOutputGP(x, y, nugget=1.e-6)
+
+    # shared fitting is done in serial, whatever the backend
+
+    def pool_fail(*args, **kwargs):
+        raise AssertionError("fitting should not use a pool of workers")
+
+    monkeypatch.setattr("mogp_emulator.fitting.Pool", pool_fail)
+    monkeypatch.setattr("mogp_emulator.fitting.ThreadPoolExecutor", pool_fail)
+
+    np.random.seed(4335)
+
+    gp = _fit_MOGP_MAP(gp, n_tries=2, shared_kernel=True, backend="thread")
+
+    theta = gp.emulators[0].theta.get_data()
+
+    for em in gp.emulators:
+        assert_allclose(em.theta.get_data(), theta)
+        assert em.Kinv is gp.emulators[0].Kinv
+        assert em._deriv_cache == {}
+
+    # result agrees with emulators fit individually with the shared values
+
+    logpost_expect = 0.
+    for i in range(3):
+        gp_single = GaussianProcess(x, y[i], nugget=1.e-6)
+        logpost_expect += gp_single.logposterior(theta)
+        assert_allclose(gp.emulators[i].Kinv_t, gp_single.Kinv_t)
+
+    assert_allclose(sum(em.current_logpost for em in gp.emulators), logpost_expect)
+
+    # refitting an individual emulator does not change the shared factor
+
+    L = np.copy(gp.emulators[1].Kinv.L)
+    gp.emulators[0].fit(np.zeros(gp.emulators[0].n_params))
+    assert_allclose(gp.emulators[1].Kinv.L, L)
+
+    # shared values are a minimum of the sum of the log-posteriors
+
+    gp_shared = MultiOutputGP(x, y, nugget=1.e-6)
+    gp_shared = _fit_MOGP_MAP(gp_shared, theta0=theta, n_tries=1, shared_kernel=True)
+
+    assert_allclose(gp_shared.emulators[2].theta.get_data(), theta, atol=1.e-4)
+
+    # only unfit emulators are fit unless refit is set
+
+    gp = MultiOutputGP(x, y, nugget=1.e-6)
+    gp.emulators[0].fit(np.ones(2))
+
+    gp = _fit_MOGP_MAP(gp, theta0=np.zeros(2), n_tries=1, shared_kernel=True)
+    assert_allclose(gp.emulators[0].theta.get_data(), np.ones(2))
+    assert_allclose(gp.emulators[1].theta.get_data(), gp.emulators[2].theta.get_data())
+
+    gp = _fit_MOGP_MAP(gp, theta0=np.zeros(2), n_tries=1, shared_kernel=True, refit=True)
+    assert_allclose(gp.emulators[0].theta.get_data(), gp.emulators[1].theta.get_data())
+
+    # emulators must be compatible
+
+    gp = MultiOutputGP(x, y, nugget=[1.e-6, 1.e-6, "fit"])
+
+    with pytest.raises(AssertionError):
+        _fit_MOGP_MAP(gp, shared_kernel=True)
+
+    gp = MultiOutputGP(x, y, nugget=[1.e-6, 1.e-6, 1.e-4])
+
+    with pytest.raises(AssertionError):
+        _fit_MOGP_MAP(gp, shared_kernel=True)
+
+    gp = MultiOutputGP(x, y, nugget=1.e-6)
+
+    with pytest.raises(AssertionError):
+        _fit_MOGP_MAP(gp, theta0=np.zeros((3, 2)), shared_kernel=True)
+
+def test_fit_MOGP_MAP_shared_kernel_logpost(monkeypatch):
+    "test that the shared kernel objective includes the prior only once"
+
+    x = np.linspace(0., 1., 10)
+    y = np.zeros((3, 10))
+    y[0] = x**2
+    y[1] = 2. + x**3
+    y[2] = np.sin(x)
+
+    gp = MultiOutputGP(x, y, mean="0", nugget=1.e-6)
+
+    theta = np.array([0.5, -0.2])
+    objective = {}
+
+    def minimize_capture(fun, x0, method=None, jac=None, options=None):
+        objective["fun"] = fun(theta)
+        objective["jac"] = jac(theta)
+        objective["fun_dx"] = [fun(theta + dx) for dx in 1.e-6*np.eye(2)]
+        return {"x": theta, "fun": objective["fun"]}
+
+    monkeypatch.setattr("mogp_emulator.fitting.minimize", minimize_capture)
+
+    gp = _fit_MOGP_MAP(gp, theta0=theta, n_tries=1, shared_kernel=True)
+
+    K = np.exp(theta[1])*gp.emulators[0].kernel.kernel_f(x, x, theta[:1]) + 1.e-6*np.eye(10)
+
+    nll_expect = 0.
+    for i in range(3):
+        nll_expect += 0.5*(np.linalg.slogdet(K)[1] + np.dot(y[i], np.linalg.solve(K, y[i])) +
+                           10*np.log(2.*np.pi))
+
+    logp = gp.emulators[0].priors.logp(gp.emulators[0].theta)
+    assert not logp == 0.
+
+    assert_allclose(objective["fun"], nll_expect - logp)
+    assert_allclose(objective["jac"], (np.array(objective["fun_dx"]) - objective["fun"])/1.e-6,
+                    rtol=1.e-4, atol=1.e-4)
+
 def test_fit_MOGP_MAP_failures():
     "test situations where fitting should fail"
 
@@ -33,6 +33,12 @@ def test_ChoInv(A, b):
     assert_allclose(Ainv.solve_L(b), x)
     
     assert_allclose(np.log(np.linalg.det(A)), Ainv.logdet())
+
+    Ainv_32 = Ainv.astype(np.float32)
+
+    assert Ainv_32.L.dtype == np.float32
+    assert Ainv_32.solve(b.astype(np.float32)).dtype == np.float32
+    assert_allclose(Ainv_32.solve(b.astype(np.float32)), np.linalg.solve(A, b), rtol=1.e-5)
     
     assert Ainv.solve(np.zeros((3,0))).shape == (3,0)
     
@@ -70,6 +76,13 @@ def test_ChoInvPivot(A, b):
     
     assert_allclose(prod, prod_pivot)
 
+    Ainv_32 = Ainv.astype(np.float32)
+
+    assert isinstance(Ainv_32, ChoInvPivot)
+    assert Ainv_32.L.dtype == np.float32
+    assert_allclose(Ainv_32.P, Ainv.P)
+    assert_allclose(Ainv_32.solve(b.astype(np.float32)), np.linalg.solve(A, b), rtol=1.e-5)
+
     with pytest.raises(AssertionError):
         ChoInvPivot(L_pivot, np.array([0, 2, 1, 1], dtype=np.int32)).solve(b)
 
@@ -125,6 +138,14 @@ def test_fixed_cholesky(A):
                              [0.0067379469990855, 0.0067379469990855, 1. + 1.e-6         ]])
     L_actual = fixed_cholesky(input_matrix)
     assert_allclose(L_expected, L_actual)
+    
+    input_matrix = np.array([[1., 2.], [2., 1.]])
+    with pytest.raises(linalg.LinAlgError):
+        fixed_cholesky(input_matrix)
+        
+    input_matrix = np.array([[1., np.nan], [np.nan, 1.]])
+    with pytest.raises(linalg.LinAlgError):
+        fixed_cholesky(input_matrix)
 
 def test_jit_cholesky():
     "Tests the stabilized Cholesky decomposition routine"
@@ -152,6 +173,24 @@ def test_jit_cholesky():
     input_matrix = np.array([[1.e-6, 1., 0.], [1., 1., 1.], [0., 1., 1.e-10]])
     with pytest.raises(linalg.LinAlgError):
         jit_cholesky(input_matrix)
+    
+    input_matrix = np.array([[1.                , 1.                , 0.0067379469990855],
+                             [1.                , 1.                , 0.0067379469990855],
+                             [0.0067379469990855, 0.0067379469990855, 1.                ]])
+    input_copy = np.copy(input_matrix)
+    out = np.empty((3, 3), order="F")
+    L_actual, jitter = jit_cholesky(input_matrix, out=out)
+    assert_allclose(L_expected, L_actual)
+    assert np.shares_memory(L_actual, out)
+    assert_allclose(input_matrix, input_copy)
+    
+    L_actual, nugget = cholesky_factor(input_matrix, 1., "fixed", out=out)
+    assert_allclose(np.linalg.cholesky(input_matrix + np.eye(3)), L_actual.L)
+    assert np.shares_memory(L_actual.L, out)
+    assert_allclose(input_matrix, input_copy)
+    
+    with pytest.raises(AssertionError):
+        jit_cholesky(input_matrix, out=np.empty((3, 3)))
 
 def test_pivot_cholesky():
     "Tests  pivoted cholesky decomposition routine"